@@ -1,721 +1,2073 @@
 import os
+import re
+import html
+import json
+import bisect
+import hashlib
+import itertools
+import math
+import time
 import subprocess
 import uuid
+import gzip
+import fcntl
 import shutil
-from flask import Flask, request, jsonify, render_template_string, send_from_directory
+import mimetypes
+import signal
+import threading
+import collections
+import contextlib
+import concurrent.futures
+import socket
+import sqlite3
+from flask import Flask, request, jsonify, send_from_directory, redirect, Response
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
 # Enable CORS for all routes. This is important for local development if frontend is on a different port,
 # and generally good practice if you intend to have other frontends consume this API.
 CORS(app)
+# Render's proxy appends the real client IP to X-Forwarded-For; only that many trailing hops are
+# trusted, so request.remote_addr is the client and cannot be set by it.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get('TRUSTED_PROXY_HOPS', 1)))
 
 # --- Configuration ---
-TEMP_VIDEO_DIR = 'temp_videos'
+TEMP_VIDEO_DIR = os.environ.get('TEMP_VIDEO_DIR', 'temp_videos')
 MAX_VIDEO_SIZE_MB = 1000 # Increased to 1GB for more flexible processing
 MAX_VIDEO_SIZE_BYTES = MAX_VIDEO_SIZE_MB * 1024 * 1024
+JOB_STATE_FILENAME = 'job.json' # Per-session checkpoint used to resume interrupted jobs
+SLICE_MAX_ATTEMPTS = 3 # A failed slice is retried up to this many times in total
+SLICE_RETRY_BACKOFF_SECONDS = 2 # Delay before the first retry; doubles on every further retry
+SLICE_MIN_TAIL_SECONDS = float(os.environ.get('SLICE_MIN_TAIL_SECONDS', 10)) # A shorter last segment is not cut on its own...
+SLICE_TAIL_STRATEGY = os.environ.get('SLICE_TAIL_STRATEGY', 'merge') # ...but 'merge'd into the one before, or all are 'rebalance'd
+SLICE_BATCH_MAX_SECONDS = 15 # Segments this short are cut several per ffmpeg run...
+SLICE_BATCH_SIZE = 8 # ...up to this many at once
+WATCHDOG_STALL_SECONDS = 45 # Kill ffmpeg when its progress output does not advance for this long
+WATCHDOG_DOWNLOAD_STALL_SECONDS = 120 # yt-dlp is quiet while merging formats, so it gets more slack
+WATCHDOG_DOWNLOAD_DEADLINE_SECONDS = 1800 # Backstop for downloads that keep trickling along
+WATCHDOG_DEADLINE_FACTOR = 4 # Hard deadline = expected runtime x this factor...
+WATCHDOG_MIN_DEADLINE_SECONDS = 60 # ...but never less than this
+WATCHDOG_POLL_SECONDS = 0.5
+WATCHDOG_HISTORY_SIZE = 20 # Rolling window of observed realtime factors per encode mode
+WATCHDOG_PRIOR_COPY_SPEED = 50.0 # Assumed realtime factor for stream copy until one is observed
+WATCHDOG_PRIOR_ENCODE_SPEED = {'libx264': 1.0, 'libx265': 0.3} # Same, per re-encode codec
+WATCHDOG_PRIOR_AUDIO_SPEED = 30.0 # Same, for audio-only work (loudness analysis, audio-only slices)
+
+# Audio: loudness targets (EBU R128 style, at the level short-form platforms normalize to) and audio-only formats
+LOUDNORM_TARGET_I = -14 # Integrated loudness, LUFS
+LOUDNORM_TARGET_TP = -1.5 # True peak, dBTP
+LOUDNORM_TARGET_LRA = 11 # Loudness range, LU
+AUDIO_OUTPUT_FORMATS = {
+    'm4a': {'codec': 'aac', 'extension': 'm4a'},
+    'opus': {'codec': 'libopus', 'extension': 'opus'},
+}
+
+# Streaming packages: fragmented-MP4 HLS renditions for in-browser previews
+HLS_SEGMENT_SECONDS = 4
+HLS_LADDER = [(720, 2500), (480, 1200), (360, 700)] # (short side in pixels, video kbps) for re-encoded slices
+HLS_VIDEO_CODEC = 'libx264'
+HLS_AUDIO_BITRATE = 128
+HLS_MIMETYPES = {'.m3u8': 'application/vnd.apple.mpegurl', '.m4s': 'video/iso.segment', '.mp4': 'video/mp4'}
+
+# Staging: small sources and scratch files in RAM (tmpfs) instead of slow disk
+STAGING_RAM_DIR = os.environ.get('STAGING_RAM_DIR', '/dev/shm') # Empty disables RAM staging
+STAGING_RAM_MAX_SOURCE_MB = int(os.environ.get('STAGING_RAM_MAX_SOURCE_MB', 300)) # Larger sources stay on disk
+STAGING_RAM_BUDGET_MB = int(os.environ.get('STAGING_RAM_BUDGET_MB', 1024)) # All RAM-staged jobs on the node together
+STAGING_RAM_MIN_FREE_MB = 512 # Never stage in RAM if that would leave less memory than this available
+IO_COUNTER_KEYS = ('rchar', 'wchar', 'read_bytes', 'write_bytes') # Per-job I/O accounting, from /proc/<pid>/io
+
+# Captions
+CUE_INDEX_CACHE_SIZE = 32 # Parsed caption tracks kept in memory, per source
+MAX_CAPTIONS_UPLOAD_BYTES = 2 * 1024 * 1024
+CAPTION_FORCE_STYLE = 'FontSize=16,Outline=2,MarginV=40' # libass style overrides for burned-in captions
+
+# Distributed mode: several instances share one task store and split the slicing work
+DISTRIBUTED_MODE = os.environ.get('DISTRIBUTED_MODE', '').lower() in ('1', 'true', 'yes')
+NODE_ID = os.environ.get('NODE_ID', socket.gethostname())
+NODE_URL = os.environ.get('NODE_URL') # Public base URL of this instance, used to redirect downloads to it
+JOB_STORE_BACKEND = os.environ.get('JOB_STORE_BACKEND', 'sqlite')
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH') # Must be on a volume every node shares (TEMP_VIDEO_DIR is node-local)
+if DISTRIBUTED_MODE and not JOB_STORE_PATH:
+    # A default inside TEMP_VIDEO_DIR would give every node its own private store, silently distributing nothing
+    raise RuntimeError("DISTRIBUTED_MODE requires JOB_STORE_PATH to point at the shared task store.")
+if DISTRIBUTED_MODE and not NODE_URL:
+    # Without it, downloads of outputs stored on this node could not be redirected here from other nodes
+    raise RuntimeError("DISTRIBUTED_MODE requires NODE_URL to be set to this instance's public base URL.")
+TASK_LEASE_SECONDS = 120 # A claimed task whose node vanished is handed out again after this long...
+TASK_LEASE_RENEW_SECONDS = 30 # ...while the node working on it renews the lease this often
+DISTRIBUTED_WAIT_SECONDS = int(os.environ.get('DISTRIBUTED_WAIT_SECONDS', 7200)) # Longest a request waits on other nodes
+AFFINITY_GRACE_SECONDS = 30 # Other nodes leave a task to the node holding its source for this long
+NODE_DEAD_AFTER_SECONDS = 60 # Nodes without a heartbeat for this long lose their affinity claims
+DISTRIBUTED_POLL_SECONDS = 1
+
+LAZY_PREFETCH_WORKERS = 1 # Background renders of the next lazy segment, per process
+
+# Sources kept for later work are deleted once idle: a lazy job's after this long without a render...
+LAZY_SOURCE_TTL_SECONDS = int(os.environ.get('LAZY_SOURCE_TTL_SECONDS', 3600))
+# ...and a failed or interrupted job's after this long (resuming downloads it again)
+IDLE_SOURCE_TTL_SECONDS = int(os.environ.get('IDLE_SOURCE_TTL_SECONDS', 6 * 3600))
+SOURCE_SWEEP_INTERVAL_SECONDS = 300 # How often each process looks for idle sources
+
+# Scheduling: node-wide admission of slicing work, fair across clients (API key or IP)
+SCHEDULER_SLOTS = int(os.environ.get('SCHEDULER_SLOTS', max(1, (os.cpu_count() or 2) // 2))) # Jobs slicing at once
+SCHEDULER_DB_PATH = os.path.join(TEMP_VIDEO_DIR, 'scheduler.sqlite3') # Node-local: shared by this node's workers only
+SCHEDULER_TENANT_WEIGHTS = json.loads(os.environ.get('SCHEDULER_TENANT_WEIGHTS', '{}')) # e.g. {"ip:1.2.3.4": 2}
+SCHEDULER_CHEAP_JOB_COST = 30 # Jobs expected to encode within this many seconds count as cheap...
+SCHEDULER_SJF_BOOST = 120 # ...and may overtake up to this many seconds of queued work
+SCHEDULER_POLL_SECONDS = 0.5
+
+# Frontend: served from prebuilt, content-hashed and pre-compressed copies of the files in FRONTEND_DIR
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend')
+FRONTEND_ASSETS = ['app.css', 'app.js']
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable' # Hashed names change whenever the content does
+
+
+class VideoTooLargeError(Exception):
+    """Raised when the downloaded source exceeds MAX_VIDEO_SIZE_BYTES."""
 
-if not os.path.exists(TEMP_VIDEO_DIR):
-    os.makedirs(TEMP_VIDEO_DIR)
-
-# --- Frontend HTML (embedded directly into Python for a single-file solution) ---
-# IMPORTANT: The JavaScript API_ENDPOINT and download_urls are now relative,
-# which allows the browser to automatically use the correct domain on Render.
-HTML_PAGE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>VideoShaper - YouTube Shorts Converter</title>
-    <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@400;600;700&family=Roboto:wght@400;500&display=swap" rel="stylesheet">
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css" integrity="sha512-Fo3rlrZj/k7ujmOfEX3L5qT4uE5T7zIq4v+n+5i2TzQzF+Bv4M3zB9y3t5R7E/D0FzP4/7zLz6t2Rz6k5vB9t6w==" crossorigin="anonymous" referrerpolicy="no-referrer" />
-    <style>
-        :root {
-            --primary-purple: #6c5ce7; /* Soft Purple */
-            --secondary-blue: #0984e3; /* Bright Blue */
-            --accent-yellow: #fdcb6e; /* Warm Yellow */
-            --light-gray: #f5f6fa;
-            --medium-gray: #dfe4ea;
-            --dark-text: #2d3436;
-            --light-text: #ffffff;
-            --success-green: #2ecc71;
-            --error-red: #e74c3c;
-            --warning-orange: #f39c12;
-
-            --header-height: 60px;
-            --footer-height: 50px;
-
-            --border-radius-sm: 8px;
-            --border-radius-md: 12px;
-
-            --shadow-light: rgba(0, 0, 0, 0.08);
-            --shadow-medium: rgba(0, 0, 0, 0.15);
-            --shadow-deep: rgba(0, 0, 0, 0.25);
-        }
-
-        /* Base Styles & Typography */
-        body {
-            font-family: 'Roboto', sans-serif;
-            margin: 0;
-            padding: 0;
-            background: linear-gradient(135deg, var(--light-gray) 0%, var(--medium-gray) 100%);
-            color: var(--dark-text);
-            min-height: 100vh;
-            display: flex;
-            flex-direction: column;
-            line-height: 1.6;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
+# --- Helper Functions ---
+def parse_time_to_seconds(time_str):
+    """
+    Parses a time string (HH:MM:SS or seconds) into total seconds.
+    Returns None if parsing fails.
+    """
+    if not time_str:
+        return None
+    try:
+        # Check if it's already an integer (seconds)
+        return int(time_str)
+    except ValueError:
+        # Try to parse as HH:MM:SS
+        parts = list(map(int, time_str.split(':')))
+        if len(parts) == 3:
+            return parts[0] * 3600 + parts[1] * 60 + parts[2]
+        elif len(parts) == 2: # MM:SS
+            return parts[0] * 60 + parts[1]
+        elif len(parts) == 1: # S or SS
+             return parts[0]
+        return None
 
-        h1, h2, h3 {
-            font-family: 'Montserrat', sans-serif;
-            color: var(--dark-text);
-            margin-top: 0;
-            margin-bottom: 1rem;
-        }
+# --- Adaptive Watchdog ---
+# Instead of a fixed wall-clock timeout, long-running subprocesses are watched for progress.
+# A process is killed when its progress output stalls for WATCHDOG_STALL_SECONDS, or when it
+# overruns a deadline derived from the expected runtime (segment duration / observed speed).
+# Observed speeds are kept per encode mode as a rolling realtime-factor history.
+
+_realtime_history = {} # mode -> deque of recent realtime factors (media seconds per wall second)
+_realtime_lock = threading.Lock()
+watchdog_metrics = {"runs": 0, "stalls": 0, "deadline_kills": 0, "completed": 0, "failed": 0}
+_metrics_lock = threading.Lock()
+
+def record_metric(name, amount=1):
+    """Increments a watchdog counter (exposed through /metrics)."""
+    with _metrics_lock:
+        watchdog_metrics[name] = watchdog_metrics.get(name, 0) + amount
+
+def encode_mode(params):
+    """Returns the key that slices with comparable encode speed share in the realtime history."""
+    if is_audio_only(params):
+        mode = f"audio:{params['output_format']}"
+    elif not needs_re_encode(params):
+        mode = 'copy'
+    else:
+        mode = f"{params.get('video_codec', 'libx264')}:{params.get('output_resolution') or 'original'}"
+    if params.get('normalize_audio'):
+        mode += '+loudnorm'
+    if params.get('package_hls') and not is_audio_only(params):
+        mode += '+hls'
+    return mode
+
+def expected_realtime_factor(mode):
+    """
+    Median of the recently observed realtime factors for a mode,
+    or a conservative prior when nothing has been observed yet.
+    """
+    with _realtime_lock:
+        history = sorted(_realtime_history.get(mode, ()))
+    if history:
+        return history[len(history) // 2]
+    kind = mode.split('+')[0].split(':')[0]
+    if kind == 'copy':
+        return WATCHDOG_PRIOR_COPY_SPEED
+    if kind == 'audio':
+        return WATCHDOG_PRIOR_AUDIO_SPEED
+    speed = WATCHDOG_PRIOR_ENCODE_SPEED.get(kind, 1.0)
+    # The priors are for 1080p; encode time scales roughly with the pixel count
+    resolution = mode.split('+')[0].partition(':')[2]
+    if 'x' in resolution:
+        width, height = map(int, resolution.split('x'))
+        speed *= (1920 * 1080) / max(width * height, 1920 * 1080 // 4)
+    if mode.endswith('+hls'):
+        # Every HLS_LADDER rendition is another encode of the same frames
+        speed /= 1 + len(HLS_LADDER)
+    return speed
+
+def record_realtime_factor(mode, media_seconds, wall_seconds):
+    """Adds an observed encode speed to the rolling history of a mode."""
+    if media_seconds <= 0 or wall_seconds <= 0:
+        return
+    with _realtime_lock:
+        history = _realtime_history.setdefault(mode, collections.deque(maxlen=WATCHDOG_HISTORY_SIZE))
+        history.append(media_seconds / wall_seconds)
+
+def expected_runtime(media_seconds, mode):
+    """Estimated wall-clock seconds needed to process media_seconds of video in the given mode."""
+    return media_seconds / expected_realtime_factor(mode)
+
+def watchdog_deadline(expected_seconds):
+    """Hard deadline for a process that is still making progress: a generous multiple of the estimate."""
+    return max(WATCHDOG_MIN_DEADLINE_SECONDS, expected_seconds * WATCHDOG_DEADLINE_FACTOR)
+
+def parse_ffmpeg_progress(line):
+    """
+    Parses a line of `ffmpeg -progress` output. Returns the output position in seconds
+    for out_time lines, otherwise None.
+    """
+    key, _, value = line.strip().partition('=')
+    # out_time_ms is (despite its name) also in microseconds
+    if key in ('out_time_us', 'out_time_ms'):
+        try:
+            return int(value) / 1_000_000
+        except ValueError:
+            return None
+    return None
 
-        h1 { font-size: 2.8rem; font-weight: 700; margin-bottom: 2rem; }
-        h2 { font-size: 1.8rem; font-weight: 600; margin-bottom: 1.5rem; }
-        h3 { font-size: 1.3rem; font-weight: 600; margin-bottom: 1rem; }
+def run_with_watchdog(command, deadline_seconds, stall_seconds=None, progress_parser=None):
+    """
+    Runs a command like subprocess.run(check=True, capture_output=True, text=True), but kills it
+    when its stdout stops making progress for stall_seconds or it runs past deadline_seconds.
+    With a progress_parser, only lines for which it returns an increasing position count as
+    progress; without one, any output line does.
+    Raises subprocess.CalledProcessError or subprocess.TimeoutExpired, like subprocess.run; the
+    latter also carries reason ('stall' or 'deadline') and the last progress position.
+    Returns (CompletedProcess, last progress position or None, I/O counters or None).
+    """
+    stall_seconds = stall_seconds or WATCHDOG_STALL_SECONDS
+    record_metric("runs")
+
+    # A new session lets us kill the whole process group (yt-dlp spawns ffmpeg for merging)
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True, start_new_session=True)
+    state = {"last_progress": time.monotonic(), "position": None}
+    stdout_tail = collections.deque(maxlen=200)
+    stderr_tail = collections.deque(maxlen=200)
+
+    def read_stdout():
+        for line in process.stdout:
+            stdout_tail.append(line)
+            if progress_parser is None:
+                state["last_progress"] = time.monotonic()
+                continue
+            position = progress_parser(line)
+            if position is not None and (state["position"] is None or position > state["position"]):
+                state["position"] = position
+                state["last_progress"] = time.monotonic()
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line)
+
+    readers = [threading.Thread(target=read_stdout, daemon=True), threading.Thread(target=read_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    started = time.monotonic()
+    killed_reason = None
+    # WNOWAIT leaves the exited process unreaped, so its final /proc/<pid>/io can still be read
+    while os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+        now = time.monotonic()
+        if now - state["last_progress"] > stall_seconds:
+            killed_reason = "stall"
+        elif now - started > deadline_seconds:
+            killed_reason = "deadline"
+        if killed_reason:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            break
+        time.sleep(WATCHDOG_POLL_SECONDS)
+
+    # Totals over the whole run, including the children it waited for (yt-dlp's ffmpeg)
+    io = read_process_io(process.pid)
+    process.wait()
+    for reader in readers:
+        reader.join(timeout=5)
+    stdout, stderr = ''.join(stdout_tail), ''.join(stderr_tail)
+
+    if killed_reason:
+        elapsed = time.monotonic() - started
+        if killed_reason == "stall":
+            record_metric("stalls")
+            app.logger.warning(f"Watchdog: no progress for {stall_seconds}s after {elapsed:.1f}s, killed: {command[0]}")
+        else:
+            record_metric("deadline_kills")
+            app.logger.warning(f"Watchdog: deadline of {deadline_seconds:.0f}s exceeded, killed: {command[0]}")
+        error = subprocess.TimeoutExpired(command, elapsed, output=stdout, stderr=stderr)
+        # How far it got, so callers can learn the real speed of a slow but healthy process
+        error.reason, error.position = killed_reason, state["position"]
+        raise error
+
+    if process.returncode != 0:
+        record_metric("failed")
+        raise subprocess.CalledProcessError(process.returncode, command, output=stdout, stderr=stderr)
+
+    record_metric("completed")
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr), state["position"], io
+
+# --- Audio Pipeline ---
+# Loudness normalization measures the whole source once (a cheap audio-only pass) and applies the
+# measured values to every slice as a single-pass, linear loudnorm. Audio-only outputs skip the
+# video stream entirely, from the download onwards.
+
+def is_audio_only(params):
+    """True when the job produces audio files (m4a/opus) instead of video shorts."""
+    return params.get('output_format') in AUDIO_OUTPUT_FORMATS
+
+def output_extension(params):
+    """File extension of the slices a job produces."""
+    if is_audio_only(params):
+        return AUDIO_OUTPUT_FORMATS[params['output_format']]['extension']
+    return 'mp4'
+
+def analyze_loudness(source_path, duration, io_totals=None):
+    """
+    Runs the loudnorm measurement pass over the source's audio (video is not decoded) and
+    returns the measured values, to be passed to loudnorm_filter() for every slice.
+    The pass's I/O counters are added to io_totals when given.
+    """
+    analysis_command = [
+        'ffmpeg',
+        '-progress', 'pipe:1', '-nostats',
+        '-i', source_path,
+        '-vn', '-sn',
+        '-af', f"loudnorm=I={LOUDNORM_TARGET_I}:TP={LOUDNORM_TARGET_TP}:LRA={LOUDNORM_TARGET_LRA}:print_format=json",
+        '-f', 'null', '-',
+    ]
+    deadline = watchdog_deadline(expected_runtime(duration, 'audio'))
+    app.logger.info(f"Analyzing loudness (deadline {deadline:.0f}s): {source_path}")
+    result, _, io = run_with_watchdog(analysis_command, deadline, progress_parser=parse_ffmpeg_progress)
+    if io_totals is not None:
+        add_io(io_totals, io)
+
+    # loudnorm prints its JSON report as the last block of stderr
+    report = result.stderr[result.stderr.rfind('{'):result.stderr.rfind('}') + 1]
+    measured = json.loads(report)
+    app.logger.info(f"Measured loudness: {measured['input_i']} LUFS, {measured['input_tp']} dBTP")
+    return {key: measured[key] for key in ('input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset')}
+
+def loudnorm_filter(measured):
+    """Builds the second-pass loudnorm filter from the values measured by analyze_loudness()."""
+    return (f"loudnorm=I={LOUDNORM_TARGET_I}:TP={LOUDNORM_TARGET_TP}:LRA={LOUDNORM_TARGET_LRA}"
+            f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+            f":offset={measured['target_offset']}:linear=true")
+
+def audio_encode_args(params, loudness, codec='aac'):
+    """FFmpeg arguments that encode the audio stream, normalized when loudness values are known."""
+    args = ['-c:a', codec]
+    if params.get('audio_bitrate'):
+        args.extend(['-b:a', f"{params['audio_bitrate']}k"])
+    if loudness:
+        # loudnorm works at 192 kHz internally; bring the output back to a normal rate
+        args.extend(['-af', loudnorm_filter(loudness), '-ar', '48000'])
+    return args
+
+# --- Captions ---
+# Captions come from the source's subtitle track (yt-dlp --write-subs) or from an uploaded
+# .srt/.vtt. Parsed cues are kept per source in a CueIndex, so looking up the cues of a slice
+# is a binary search instead of a rescan. Each slice gets its own re-timed cue list, which is
+# burned in by the subtitles filter during the slice's (already required) re-encode.
+
+class CueIndex:
+    """
+    Interval index over caption cues (start, end, text), sorted by start time.
+    max_end[i] is the largest end time among cues[0..i], which is non-decreasing, so both the
+    first cue that can still overlap a window and the last cue starting inside it are found by bisection.
+    """
 
-        p {
-            font-size: 1rem;
-            line-height: 1.7;
-        }
+    def __init__(self, cues):
+        self.cues = sorted(cues)
+        self.starts = [cue[0] for cue in self.cues]
+        self.max_end = list(itertools.accumulate((cue[1] for cue in self.cues), max))
+
+    def overlapping(self, window_start, window_end):
+        """Returns the cues that overlap [window_start, window_end)."""
+        first = bisect.bisect_right(self.max_end, window_start)
+        last = bisect.bisect_left(self.starts, window_end)
+        return [cue for cue in self.cues[first:last] if cue[1] > window_start]
+
+_cue_index_cache = collections.OrderedDict() # source key -> CueIndex, least recently used first
+_cue_index_lock = threading.Lock()
+
+def parse_caption_timestamp(value):
+    """Parses an SRT/VTT timestamp (HH:MM:SS,mmm, HH:MM:SS.mmm or MM:SS.mmm) into seconds."""
+    parts = value.strip().replace(',', '.').split(':')
+    seconds = float(parts[-1])
+    if len(parts) >= 2:
+        seconds += int(parts[-2]) * 60
+    if len(parts) == 3:
+        seconds += int(parts[0]) * 3600
+    return seconds
+
+def parse_captions(text, rolling=False):
+    """
+    Parses SRT or WebVTT text into a list of (start, end, text) cues, stripping inline tags.
+    With rolling=True (YouTube's auto-generated captions, where every cue repeats the line
+    before it), lines repeated from the previous cue are dropped.
+    """
+    cues = []
+    previous_lines = []
+    for block in re.split(r'\n\s*\n', text.replace('\r\n', '\n').replace('\r', '\n')):
+        lines = block.strip().split('\n')
+        timing_index = next((i for i, line in enumerate(lines) if '-->' in line), None)
+        if timing_index is None:
+            continue # WEBVTT header, NOTE/STYLE blocks, stray text
+        start_str, _, rest = lines[timing_index].partition('-->')
+        try:
+            start = parse_caption_timestamp(start_str)
+            end = parse_caption_timestamp(rest.split()[0])
+        except (ValueError, IndexError):
+            continue
+
+        cue_lines = [re.sub(r'<[^>]*>', '', line).strip() for line in lines[timing_index + 1:]]
+        cue_lines = [line for line in cue_lines if line and not (rolling and line in previous_lines)]
+        previous_lines = cue_lines or previous_lines
+        if cue_lines and end > start:
+            cues.append((start, end, html.unescape('\n'.join(cue_lines))))
+    return cues
+
+def fetch_source_captions(params, session_dir):
+    """
+    Downloads the source's subtitle track with yt-dlp: manual subtitles, falling back to
+    auto-generated ones. Returns (text, auto_generated), or (None, False) when the video has no
+    captions in that language. yt-dlp failures raise like run_with_watchdog.
+    """
+    language = params.get('caption_language') or 'en'
+    for name, flag in (('captions', '--write-subs'), ('auto_captions', '--write-auto-subs')):
+        subtitle_command = [
+            'yt-dlp',
+            '--newline',
+            '--skip-download',
+            flag,
+            '--sub-langs', language,
+            '--sub-format', 'vtt/srt/best',
+            '-o', os.path.join(session_dir, name),
+            params['url'],
+        ]
+        run_with_watchdog(subtitle_command, WATCHDOG_DOWNLOAD_DEADLINE_SECONDS, stall_seconds=WATCHDOG_DOWNLOAD_STALL_SECONDS)
 
-        small {
-            display: block;
-            margin-top: 0.5rem;
-            color: #7f8c8d;
-            font-size: 0.85em;
-        }
+        for filename in sorted(os.listdir(session_dir)):
+            if filename.startswith(f"{name}.") and filename.endswith(('.vtt', '.srt')):
+                with open(os.path.join(session_dir, filename), encoding='utf-8', errors='replace') as f:
+                    return f.read(), name == 'auto_captions'
+    return None, False
 
-        /* Layout Structure */
-        .header {
-            background: var(--primary-purple);
-            padding: 1rem 2rem;
-            color: var(--light-text);
-            box-shadow: 0 2px 10px var(--shadow-deep);
-            z-index: 1000;
-            position: sticky;
-            top: 0;
-        }
+def get_cue_index(params, session_dir):
+    """
+    Returns the CueIndex for a job's source, parsing (and, if needed, fetching) its captions only
+    on the first request for that source. Returns None when no captions are available,
+    including when fetching them failed (captions are optional; that result is not cached).
+    """
+    if params.get('captions_text'):
+        key = ('upload', hashlib.sha1(params['captions_text'].encode('utf-8')).hexdigest())
+    else:
+        key = ('source', params['url'], params.get('caption_language') or 'en')
+
+    with _cue_index_lock:
+        if key in _cue_index_cache:
+            _cue_index_cache.move_to_end(key)
+            return _cue_index_cache[key]
+
+    if params.get('captions_text'):
+        text, auto_generated = params['captions_text'], False
+    else:
+        try:
+            text, auto_generated = fetch_source_captions(params, session_dir)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+            app.logger.warning(f"Could not fetch captions for {params['url']}: {e}")
+            return None
+    cue_index = CueIndex(parse_captions(text, rolling=auto_generated)) if text else None
+
+    with _cue_index_lock:
+        _cue_index_cache[key] = cue_index
+        while len(_cue_index_cache) > CUE_INDEX_CACHE_SIZE:
+            _cue_index_cache.popitem(last=False)
+    return cue_index
+
+def slice_captions(cue_index, source_offset, start_time, slice_duration):
+    """
+    Returns the cues of one slice, re-timed to the slice's own timeline and clipped to its length.
+    source_offset is where the downloaded section starts in the original video (caption timestamps
+    refer to the full video).
+    """
+    window_start = source_offset + start_time
+    window_end = window_start + slice_duration
+    return [
+        [max(cue_start, window_start) - window_start, min(cue_end, window_end) - window_start, cue_text]
+        for cue_start, cue_end, cue_text in cue_index.overlapping(window_start, window_end)
+    ]
+
+def format_srt(cues):
+    """Formats (start, end, text) cues as an SRT document."""
+    def timestamp(seconds):
+        millis = int(round(seconds * 1000))
+        return f"{millis // 3600000:02d}:{millis // 60000 % 60:02d}:{millis // 1000 % 60:02d},{millis % 1000:03d}"
+
+    return ''.join(f"{i}\n{timestamp(start)} --> {timestamp(end)}\n{text}\n\n"
+                   for i, (start, end, text) in enumerate(cues, start=1))
+
+def subtitles_filter(srt_path):
+    """Builds a subtitles filter for a cue file, escaping the path for the filtergraph parser."""
+    escaped = srt_path.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+    return f"subtitles=filename='{escaped}':force_style='{CAPTION_FORCE_STYLE}'"
+
+# --- Fair Scheduling ---
+# Slicing work on a node is admitted through a shared scheduler (a small SQLite file, so that all
+# gunicorn workers on the node see one queue). At most SCHEDULER_SLOTS jobs slice at once. Waiting
+# jobs are ordered by weighted fair queuing across tenants (API key, or client IP): each job gets a
+# virtual finish tag = max(virtual clock, tenant's previous finish tag) + cost / tenant weight, with
+# cost = expected encode seconds. Cheap jobs get a shortest-job-first boost on top.
+
+class JobScheduler:
+    """Node-wide weighted fair queue of slicing jobs, shared by all worker processes through SQLite."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS queue (
+                    job_id TEXT PRIMARY KEY,
+                    tenant TEXT NOT NULL,
+                    cost REAL NOT NULL,
+                    start_tag REAL NOT NULL,
+                    finish_tag REAL NOT NULL,
+                    sort_key REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    dispatched_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS tenants (
+                    tenant TEXT PRIMARY KEY,
+                    last_finish_tag REAL NOT NULL DEFAULT 0,
+                    dispatched INTEGER NOT NULL DEFAULT 0,
+                    total_wait REAL NOT NULL DEFAULT 0,
+                    max_wait REAL NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS clock (id INTEGER PRIMARY KEY CHECK (id = 0), virtual_time REAL NOT NULL);
+                INSERT OR IGNORE INTO clock (id, virtual_time) VALUES (0, 0);
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return contextlib.closing(conn)
+
+    @staticmethod
+    def _purge_dead(conn):
+        # Entries of worker processes that died (e.g. killed by gunicorn) would otherwise hold their place forever
+        for row in conn.execute("SELECT job_id, pid FROM queue").fetchall():
+            try:
+                os.kill(row['pid'], 0)
+            except ProcessLookupError:
+                conn.execute("DELETE FROM queue WHERE job_id = ?", (row['job_id'],))
+            except PermissionError:
+                pass
+
+    def submit(self, job_id, tenant, cost, weight):
+        """Adds a job to the queue and returns its finish tag."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            virtual_time = conn.execute("SELECT virtual_time FROM clock").fetchone()['virtual_time']
+            conn.execute("INSERT OR IGNORE INTO tenants (tenant) VALUES (?)", (tenant,))
+            last_finish = conn.execute("SELECT last_finish_tag FROM tenants WHERE tenant = ?", (tenant,)).fetchone()[0]
+            start_tag = max(virtual_time, last_finish)
+            finish_tag = start_tag + cost / weight
+            sort_key = finish_tag - (SCHEDULER_SJF_BOOST if cost <= SCHEDULER_CHEAP_JOB_COST else 0)
+            conn.execute("UPDATE tenants SET last_finish_tag = ? WHERE tenant = ?", (finish_tag, tenant))
+            conn.execute("INSERT OR REPLACE INTO queue (job_id, tenant, cost, start_tag, finish_tag, sort_key, status, pid, enqueued_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, 'waiting', ?, ?)",
+                         (job_id, tenant, cost, start_tag, finish_tag, sort_key, os.getpid(), time.time()))
+            conn.execute("COMMIT")
+        return finish_tag
+
+    def try_dispatch(self, job_id):
+        """Starts the job if a slot is free and it is first in line. Returns True when it may run."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._purge_dead(conn)
+                running = conn.execute("SELECT COUNT(*) FROM queue WHERE status = 'running'").fetchone()[0]
+                head = conn.execute("SELECT * FROM queue WHERE status = 'waiting' "
+                                    "ORDER BY sort_key, enqueued_at LIMIT 1").fetchone()
+                if running >= SCHEDULER_SLOTS or head is None or head['job_id'] != job_id:
+                    conn.execute("COMMIT")
+                    return False
+
+                now = time.time()
+                waited = now - head['enqueued_at']
+                conn.execute("UPDATE queue SET status = 'running', dispatched_at = ? WHERE job_id = ?", (now, job_id))
+                conn.execute("UPDATE clock SET virtual_time = MAX(virtual_time, ?)", (head['start_tag'],))
+                conn.execute("UPDATE tenants SET dispatched = dispatched + 1, total_wait = total_wait + ?, "
+                             "max_wait = MAX(max_wait, ?) WHERE tenant = ?", (waited, waited, head['tenant']))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        app.logger.info(f"Scheduler: dispatched {job_id} (tenant {head['tenant']}, cost {head['cost']:.1f}s, "
+                        f"finish tag {head['finish_tag']:.1f}, waited {waited:.1f}s, {running + 1}/{SCHEDULER_SLOTS} slots busy)")
+        return True
+
+    def has_free_slot(self):
+        """Whether fewer than SCHEDULER_SLOTS jobs are running right now."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._purge_dead(conn)
+            running = conn.execute("SELECT COUNT(*) FROM queue WHERE status = 'running'").fetchone()[0]
+            conn.execute("COMMIT")
+        return running < SCHEDULER_SLOTS
+
+    def release(self, job_id):
+        """Removes a job from the queue, freeing its slot if it was running."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM queue WHERE job_id = ?", (job_id,))
+
+    def snapshot(self):
+        """Current queue and per-tenant statistics, for tuning."""
+        now = time.time()
+        with self._connect() as conn:
+            queue = [dict(row) for row in conn.execute("SELECT * FROM queue ORDER BY status DESC, sort_key").fetchall()]
+            tenants = [dict(row) for row in conn.execute("SELECT * FROM tenants ORDER BY tenant").fetchall()]
+            virtual_time = conn.execute("SELECT virtual_time FROM clock").fetchone()['virtual_time']
+        for entry in queue:
+            entry['waiting_for'] = (entry['dispatched_at'] or now) - entry['enqueued_at']
+        for tenant in tenants:
+            tenant['avg_wait'] = tenant['total_wait'] / tenant['dispatched'] if tenant['dispatched'] else 0
+        return {"slots": SCHEDULER_SLOTS, "virtualTime": virtual_time, "queue": queue, "tenants": tenants}
+
+_job_scheduler = None
+
+def get_job_scheduler():
+    """Returns this process's handle on the node's scheduler, created on first use."""
+    global _job_scheduler
+    if _job_scheduler is None:
+        _job_scheduler = JobScheduler(SCHEDULER_DB_PATH)
+    return _job_scheduler
+
+def request_tenant():
+    """Identifies the client of the current request: its API key (hashed) or, failing that, its IP."""
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        return f"key:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]}"
+    # remote_addr comes from the hop our trusted proxy added (see ProxyFix above), never from the client
+    return f"ip:{request.remote_addr}"
+
+def tenant_weight(tenant):
+    """Share of slicing capacity a tenant gets relative to others (default 1)."""
+    return float(SCHEDULER_TENANT_WEIGHTS.get(tenant, 1))
+
+def estimate_job_cost(params, media_seconds):
+    """Expected encode wall-clock seconds for media_seconds of video in the job's mode and resolution."""
+    return max(1.0, expected_runtime(media_seconds, encode_mode(params)))
+
+@contextlib.contextmanager
+def scheduled_slot(job, media_seconds):
+    """Waits until the scheduler admits the job's slicing work, and holds its slot for the block."""
+    scheduler = get_job_scheduler()
+    tenant = job.get('tenant') or 'anonymous'
+    cost = estimate_job_cost(job['params'], media_seconds)
+    slot_id = f"{job['session_id']}:{uuid.uuid4().hex[:8]}"
+    scheduler.submit(slot_id, tenant, cost, tenant_weight(tenant))
+    try:
+        while not scheduler.try_dispatch(slot_id):
+            time.sleep(SCHEDULER_POLL_SECONDS)
+        yield
+    finally:
+        scheduler.release(slot_id)
 
-        .header-content {
-            max-width: 1200px;
-            margin: 0 auto;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
+# --- Streaming Packages (HLS) ---
+# With package_hls, every video slice is also written as fragmented-MP4 HLS, as a second output of
+# the slice's own ffmpeg command (the source is read and decoded once for both). Stream-copied
+# slices get a single copied rendition; re-encoded slices get the HLS_LADDER renditions.
 
-        .logo {
-            font-family: 'Montserrat', sans-serif;
-            font-size: 1.8rem;
-            font-weight: 700;
-            color: var(--light-text);
-            margin: 0;
-        }
+def hls_scale_filter(short_side):
+    """Scales so the frame's short side is at most short_side (never upscaling), keeping even dimensions."""
+    limit_w = f"trunc(min({short_side},iw)/2)*2"
+    limit_h = f"trunc(min({short_side},ih)/2)*2"
+    return f"scale=w='if(gt(iw,ih),-2,{limit_w})':h='if(gt(iw,ih),{limit_h},-2)'"
 
-        .main-content {
-            flex-grow: 1;
-            padding: 40px 20px;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-        }
+def hls_output_args(params, hls_dir, video_filters, loudness, has_audio=True):
+    """
+    FFmpeg arguments for the HLS output of a slice command. video_filters are the filters the
+    slice's MP4 output uses (resolution, captions); every rendition starts from the same picture.
+    Renditions carry no audio when the source has none (has_audio=False).
+    """
+    hls_args = [
+        '-f', 'hls',
+        '-hls_time', str(HLS_SEGMENT_SECONDS),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_type', 'fmp4',
+        '-hls_flags', 'independent_segments',
+        '-master_pl_name', 'master.m3u8', # Written next to the variant playlists
+    ]
+
+    if not needs_re_encode(params):
+        # Copy-mode fast path: one rendition with the source's own streams
+        output_args = ['-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'copy']
+        output_args.extend(audio_encode_args(params, loudness) if loudness else ['-c:a', 'copy'])
+        return output_args + hls_args + [
+            '-hls_fmp4_init_filename', 'init.mp4',
+            '-hls_segment_filename', os.path.join(hls_dir, 'seg_%03d.m4s'),
+            os.path.join(hls_dir, 'index.m3u8'),
+        ]
 
-        .footer {
-            background: var(--dark-text);
-            color: var(--light-text);
-            padding: 1rem 2rem;
-            text-align: center;
-            font-size: 0.9rem;
-            box-shadow: 0 -2px 10px var(--shadow-deep);
-            margin-top: auto; /* Pushes footer to bottom */
-        }
+    output_args = []
+    for i, (short_side, bitrate) in enumerate(HLS_LADDER):
+        output_args.extend(['-map', '0:v:0', '-map', '0:a:0'] if has_audio else ['-map', '0:v:0'])
+        output_args.extend([
+            f'-filter:v:{i}', ','.join(video_filters + [hls_scale_filter(short_side)]),
+            f'-c:v:{i}', HLS_VIDEO_CODEC, # H.264 plays in every browser, whatever the download's codec
+            f'-b:v:{i}', f"{bitrate}k",
+            f'-maxrate:v:{i}', f"{bitrate * 6 // 5}k",
+            f'-bufsize:v:{i}', f"{bitrate * 2}k",
+        ])
+    if has_audio:
+        output_args.extend(['-c:a', 'aac', '-b:a', f"{HLS_AUDIO_BITRATE}k"])
+    if has_audio and loudness:
+        output_args.extend(['-af', loudnorm_filter(loudness), '-ar', '48000'])
+    # Keyframes on segment boundaries, so every rendition can switch at every segment
+    output_args.extend(['-force_key_frames', f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})"])
+
+    var_stream_map = ' '.join(f"v:{i},a:{i}" if has_audio else f"v:{i}" for i in range(len(HLS_LADDER)))
+    return output_args + hls_args + [
+        '-var_stream_map', var_stream_map,
+        '-hls_fmp4_init_filename', 'init_%v.mp4',
+        '-hls_segment_filename', os.path.join(hls_dir, 'stream_%v_%03d.m4s'),
+        os.path.join(hls_dir, 'stream_%v.m3u8'),
+    ]
+
+def prepare_hls_dir(hls_dir):
+    """Empties a slice's HLS directory, dropping anything a failed attempt left behind."""
+    shutil.rmtree(hls_dir, ignore_errors=True)
+    os.makedirs(hls_dir)
+
+def stream_url(session_id, filename, base_url=''):
+    """URL of a slice's HLS master playlist."""
+    return f"{base_url}/stream/{session_id}/{os.path.splitext(filename)[0]}/master.m3u8"
+
+# --- Staging Tiers and I/O Accounting ---
+# Sources are downloaded straight into RAM (tmpfs, /dev/shm by default) when there is room, so
+# each slice re-reads them from memory rather than slow disk. yt-dlp gives up on sources above
+# STAGING_RAM_MAX_SOURCE_MB, which are then downloaded to TEMP_VIDEO_DIR instead. RAM-staged jobs
+# (with a reservation while downloading) stay within STAGING_RAM_BUDGET_MB and leave
+# STAGING_RAM_MIN_FREE_MB of the machine's memory available. Job scratch files (caption
+# cues) live next to the source. Outputs are written under a temporary name in their final
+# directory and renamed into place, so a half-written file is never served.
+
+def ram_staging_root():
+    """Directory for RAM-staged sources, or None when RAM staging is unavailable or disabled."""
+    if not STAGING_RAM_DIR or STAGING_RAM_BUDGET_MB <= 0 or not os.path.isdir(STAGING_RAM_DIR):
+        return None
+    return os.path.join(STAGING_RAM_DIR, 'videoshaper')
 
-        /* Container Styling */
-        .container {
-            max-width: 800px; /* Wider container */
-            width: 100%;
-            background: var(--light-text);
-            padding: 40px 50px; /* More generous padding */
-            border-radius: var(--border-radius-md);
-            box-shadow: 0 15px 40px var(--shadow-medium);
-            border: 1px solid var(--medium-gray);
-            transition: all 0.3s ease-in-out;
-        }
+def source_path(job):
+    """Where a job's source video is (or will be) stored."""
+    return job.get('source_path') or os.path.join(TEMP_VIDEO_DIR, job['session_id'], 'original_video.mp4')
 
-        .intro-section {
-            text-align: center;
-            margin-bottom: 3rem;
-        }
+def scratch_dir(job):
+    """Directory for a job's intermediate files: next to its source, so in RAM when the source is."""
+    return os.path.dirname(source_path(job))
 
-        .intro-section h1 {
-            color: var(--primary-purple);
-            font-size: 3.2rem;
-            margin-bottom: 1rem;
-        }
+def mem_available_bytes():
+    """MemAvailable from /proc/meminfo, or None where that is not available."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def ram_staging_usage(root):
+    """Bytes held in RAM staging: per job, the larger of its download reservation and the files it wrote."""
+    usage = 0
+    now = time.time()
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        used = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+        reservation_path = os.path.join(entry.path, '.reservation')
+        try:
+            # A reservation older than any download could take belongs to a crashed process
+            if now - os.path.getmtime(reservation_path) < WATCHDOG_DOWNLOAD_DEADLINE_SECONDS:
+                with open(reservation_path) as f:
+                    used = max(used, int(f.read()))
+        except (OSError, ValueError):
+            pass
+        usage += used
+    return usage
+
+def reserve_ram_staging(job):
+    """
+    Picks the tier a job's source is downloaded to and records it in the job. RAM is picked when
+    the budget and free memory can take the download's worst case: yt-dlp keeps the separate
+    video and audio parts (each capped at STAGING_RAM_MAX_SOURCE_MB) next to the merged file until
+    it is done. The reservation is written under a lock shared by all workers and dropped by
+    end_ram_reservation() once the download is over. Returns the path to download to.
+    """
+    job.pop('source_path', None)
+    job['staging'] = 'disk'
+    root = ram_staging_root()
+    if root is None:
+        return source_path(job)
+    reservation = 2 * STAGING_RAM_MAX_SOURCE_MB * 1024 * 1024
+
+    os.makedirs(root, exist_ok=True)
+    staging_dir = os.path.join(root, job['session_id'])
+    with open(os.path.join(root, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            within_budget = ram_staging_usage(root) + reservation <= STAGING_RAM_BUDGET_MB * 1024 * 1024
+            available = mem_available_bytes()
+            enough_memory = available is None or available - reservation >= STAGING_RAM_MIN_FREE_MB * 1024 * 1024
+            if not (within_budget and enough_memory):
+                app.logger.info(f"RAM staging full or memory low; downloading {job['session_id']} to disk")
+                return source_path(job)
+            os.makedirs(staging_dir, exist_ok=True)
+            with open(os.path.join(staging_dir, '.reservation'), 'w') as f:
+                f.write(str(reservation))
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    job['source_path'] = os.path.join(staging_dir, 'original_video.mp4')
+    job['staging'] = 'ram'
+    return job['source_path']
+
+def end_ram_reservation(job):
+    """Drops a RAM-staged job's download reservation; from now on its files count for themselves."""
+    if job.get('staging') == 'ram':
+        reservation_path = os.path.join(os.path.dirname(source_path(job)), '.reservation')
+        if os.path.exists(reservation_path):
+            os.remove(reservation_path)
+
+def release_source(job):
+    """Deletes a job's source (and its RAM staging directory with any scratch files)."""
+    path = source_path(job)
+    if os.path.exists(path):
+        os.remove(path)
+        app.logger.info(f"Removed original video: {path}")
+    if job.get('staging') == 'ram':
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+_last_source_sweep = 0
+
+def expire_idle_sources():
+    """
+    Deletes the sources of jobs that are not complete but have been idle (no checkpoint, no render)
+    for longer than their TTL, skipping jobs that are running, and RAM staging directories left
+    behind by removed sessions. Does nothing if this process swept less than
+    SOURCE_SWEEP_INTERVAL_SECONDS ago.
+    """
+    global _last_source_sweep
+    now = time.time()
+    if now - _last_source_sweep < SOURCE_SWEEP_INTERVAL_SECONDS or not os.path.isdir(TEMP_VIDEO_DIR):
+        return
+    _last_source_sweep = now
+
+    for entry in os.scandir(TEMP_VIDEO_DIR):
+        job = load_job_state(entry.name) if entry.is_dir() else None
+        if job is None or job['status'] == 'complete':
+            continue
+        try:
+            # Renders touch the source, every checkpoint rewrites the job state
+            last_used = max(os.path.getmtime(source_path(job)), os.path.getmtime(job_state_path(entry.name)))
+        except OSError:
+            continue # No source left
+        ttl = LAZY_SOURCE_TTL_SECONDS if job.get('lazy') else IDLE_SOURCE_TTL_SECONDS
+        if now - last_used < ttl:
+            continue
+        try:
+            with session_file_lock(entry.name, 'job', blocking=False):
+                app.logger.info(f"Source of {entry.name} ({job['status']}) idle for {now - last_used:.0f}s; removing it")
+                release_source(job)
+        except BlockingIOError:
+            pass # Being resumed right now
+
+    root = ram_staging_root()
+    if root and os.path.isdir(root):
+        for entry in os.scandir(root):
+            if entry.is_dir() and load_job_state(entry.name) is None:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+def read_process_io(pid):
+    """Reads /proc/<pid>/io (Linux): bytes read/written through syscalls and from/to storage."""
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return {key: int(counters[key]) for key in IO_COUNTER_KEYS}
+    except (OSError, ValueError, KeyError):
+        return None
 
-        .intro-section p {
-            max-width: 600px;
-            margin: 0 auto;
-            color: #555;
-            font-size: 1.1rem;
-        }
+def add_io(totals, io):
+    """Adds one process's I/O counters to a running total (a dict stored on a job or slice)."""
+    for key, value in (io or {}).items():
+        totals[key] = totals.get(key, 0) + value
+    return totals
+
+def job_io_totals(job):
+    """I/O counters of a whole job: its source stages plus every slice."""
+    totals = dict(job.get('io') or {})
+    for slice_info in job.get('slices') or ():
+        add_io(totals, slice_info.get('io'))
+    totals['staging'] = job.get('staging', 'disk')
+    return totals
+
+# --- Segment Planning ---
+# Where the cuts go and which of them share an ffmpeg run. Both are pure functions of durations,
+# kept apart from the code that spawns processes.
+
+def plan_segments(full_video_duration, slice_duration, min_tail=None, strategy=None):
+    """
+    Splits a source into (start, duration) segments of slice_duration seconds.
+    A last segment shorter than min_tail (capped at half a slice) is not cut on its own: with the
+    'merge' strategy it is added to the segment before, with 'rebalance' the segments are evened
+    out to equal length. min_tail and strategy default to SLICE_MIN_TAIL_SECONDS and SLICE_TAIL_STRATEGY.
+    """
+    min_tail = SLICE_MIN_TAIL_SECONDS if min_tail is None else min_tail
+    strategy = SLICE_TAIL_STRATEGY if strategy is None else strategy
+    if strategy not in ('merge', 'rebalance'):
+        raise ValueError(f"Unknown tail strategy: {strategy}")
+    if full_video_duration <= 0:
+        return []
+
+    count = math.ceil(full_video_duration / slice_duration)
+    tail = full_video_duration - (count - 1) * slice_duration
+    if count > 1 and tail < min(min_tail, slice_duration / 2):
+        count -= 1
+        if strategy == 'rebalance':
+            duration = full_video_duration / count
+            return [(round(i * duration, 3), round(duration, 3)) for i in range(count)]
+
+    segments = [(i * slice_duration, slice_duration) for i in range(count - 1)]
+    last_start = (count - 1) * slice_duration
+    segments.append((last_start, round(full_video_duration - last_start, 3)))
+    return segments
+
+def plan_batches(slices, max_segment_seconds=SLICE_BATCH_MAX_SECONDS, batch_size=SLICE_BATCH_SIZE):
+    """
+    Groups slice records into batches to be cut by one ffmpeg run each: adjacent slices (consecutive
+    indexes) no longer than max_segment_seconds, at most batch_size per batch. Every other slice is
+    a batch of its own. Order is preserved.
+    """
+    batches = []
+    for slice_info in slices:
+        batch = batches[-1] if batches else None
+        if (batch and slice_info['duration'] <= max_segment_seconds and len(batch) < batch_size
+                and batch[-1]['duration'] <= max_segment_seconds and batch[-1]['index'] + 1 == slice_info['index']):
+            batch.append(slice_info)
+        else:
+            batches.append([slice_info])
+    return batches
+
+# --- Job Checkpointing ---
+# Every conversion is a "job" whose state lives in temp_videos/<session>/job.json.
+# The state is rewritten after each slice, so a job interrupted by a failed slice
+# or a worker restart can be resumed from the last completed slice.
+
+def job_state_path(session_id):
+    """Returns the path of the checkpoint file for a session."""
+    return os.path.join(TEMP_VIDEO_DIR, session_id, JOB_STATE_FILENAME)
+
+def save_job_state(job):
+    """
+    Atomically writes the job state to disk (write to a temp file, then rename),
+    so a crash mid-write never leaves a truncated checkpoint behind.
+    """
+    path = job_state_path(job['session_id'])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+def load_job_state(session_id):
+    """Loads the job state for a session. Returns None if there is no (readable) checkpoint."""
+    try:
+        with open(job_state_path(session_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-        /* Form Elements */
-        .form-group {
-            margin-bottom: 1.5rem; /* Increased spacing */
+def plan_slices(full_video_duration, slice_duration, session_id, extension='mp4'):
+    """Builds the list of slice records (all pending) for a source of the given duration."""
+    return [
+        {
+            "index": i + 1,
+            "start": start,
+            "duration": duration,
+            "filename": f"short_segment_{i+1}_{session_id}.{extension}",
+            "status": "pending",
+            "attempts": 0,
+            "error": None,
         }
+        for i, (start, duration) in enumerate(plan_segments(full_video_duration, slice_duration))
+    ]
 
-        label {
-            display: block;
-            margin-bottom: 0.6rem;
-            font-weight: 600;
-            color: var(--dark-text);
-            font-size: 1.05rem;
-        }
+def source_format(params):
+    """yt-dlp format selection for a job's source."""
+    if is_audio_only(params):
+        # No video stream is ever needed, so don't download one
+        return 'bestaudio[ext=m4a]/bestaudio'
+    return 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]'
 
-        input[type="url"],
-        input[type="number"],
-        input[type="text"],
-        select {
-            width: 100%;
-            padding: 0.8rem 1rem;
-            border: 1px solid var(--medium-gray);
-            border-radius: var(--border-radius-sm);
-            font-size: 1rem;
-            color: var(--dark-text);
-            background-color: var(--light-gray);
-            box-shadow: inset 0 1px 3px var(--shadow-light);
-            transition: border-color 0.3s ease, box-shadow 0.3s ease;
-            box-sizing: border-box;
-        }
+def download_source(params, original_video_path, max_filesize_mb=None):
+    """
+    Downloads the YouTube video (or the requested section of it) using yt-dlp.
+    With max_filesize_mb, yt-dlp skips (or abandons) a download larger than that, and no file is
+    written. Returns the download's I/O counters.
+    """
+    app.logger.info(f"Downloading {params['url']} to {original_video_path}")
+    download_command = [
+        'yt-dlp',
+        '--newline', # One progress line per update, so the watchdog can see it
+        '--restrict-filenames',
+        '-o', original_video_path,
+    ]
+    if max_filesize_mb:
+        download_command.extend(['--max-filesize', f"{max_filesize_mb}M"])
+    download_command.extend(['-f', source_format(params)])
+    if not is_audio_only(params):
+        download_command.extend(['--merge-output-format', 'mp4'])
+
+    download_start_seconds = params.get('download_start_seconds')
+    download_end_seconds = params.get('download_end_seconds')
+
+    # Add download sections if specified
+    if download_start_seconds is not None and download_end_seconds is not None:
+        download_command.extend(['--download-sections', f"*{download_start_seconds}-{download_end_seconds}"])
+    elif download_start_seconds is not None:
+        download_command.extend(['--download-sections', f"*{download_start_seconds}-inf"])
+    elif download_end_seconds is not None:
+        download_command.extend(['--download-sections', f"*0-{download_end_seconds}"])
+
+    download_command.append(params['url'])
+
+    _, _, io = run_with_watchdog(download_command, WATCHDOG_DOWNLOAD_DEADLINE_SECONDS, stall_seconds=WATCHDOG_DOWNLOAD_STALL_SECONDS)
+    app.logger.info(f"Download complete: {original_video_path}")
+    return io
+
+def probe_duration(video_path):
+    """Returns the duration of a media file in seconds, as reported by ffprobe."""
+    probe_command = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        video_path
+    ]
+    duration_output = subprocess.run(probe_command, check=True, capture_output=True, text=True, timeout=60)
+    return float(duration_output.stdout.strip())
+
+def probe_has_audio(video_path):
+    """Returns whether a media file has at least one audio stream, as reported by ffprobe."""
+    probe_command = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'a',
+        '-show_entries', 'stream=index',
+        '-of', 'csv=p=0',
+        video_path
+    ]
+    streams_output = subprocess.run(probe_command, check=True, capture_output=True, text=True, timeout=60)
+    return bool(streams_output.stdout.strip())
+
+def needs_re_encode(params):
+    """
+    Re-encoding is only needed when the user asked for something other than the defaults.
+    params['captions'] is cleared by prepare_source() when the source turns out to have none.
+    """
+    return bool(params.get('output_resolution') or params.get('video_bitrate') or params.get('audio_bitrate')
+                or params.get('video_codec', 'libx264') != 'libx264' or params.get('captions'))
 
-        input[type="url"]:focus,
-        input[type="number"]:focus,
-        input[type="text"]:focus,
-        select:focus {
-            border-color: var(--primary-purple);
-            box-shadow: 0 0 0 3px rgba(108, 92, 231, 0.25); /* Focus ring */
-            outline: none;
-            background-color: var(--light-text);
-        }
+def is_stream_copy(params, loudness=None):
+    """Whether slices are cut by copying streams (or remuxing AAC audio) without decoding anything."""
+    if is_audio_only(params):
+        return not (loudness or params.get('audio_bitrate')) and AUDIO_OUTPUT_FORMATS[params['output_format']]['codec'] == 'aac'
+    return not (needs_re_encode(params) or loudness)
 
-        /* Buttons */
-        .btn-primary {
-            width: 100%;
-            padding: 1rem 1.5rem;
-            background: linear-gradient(45deg, var(--primary-purple) 0%, var(--secondary-blue) 100%);
-            color: var(--light-text);
-            border: none;
-            border-radius: var(--border-radius-sm);
-            font-size: 1.15rem;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            box-shadow: 0 6px 20px rgba(108, 92, 231, 0.3);
-            margin-top: 1.5rem;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-        }
+def build_slice_command(params, original_video_path, start_time, slice_duration, output_slice_path,
+                        loudness=None, captions_path=None, hls_dir=None, has_audio=True):
+    """
+    Builds the FFmpeg command that cuts a single slice out of the source video.
+    loudness holds the source's measured values when the audio is to be normalized;
+    captions_path is the slice's re-timed SRT file when captions are burned in;
+    hls_dir, when given, adds an HLS package of the slice as a second output
+    (with video-only renditions when has_audio is False).
+    """
+    slice_command = [
+        'ffmpeg',
+        '-y', # Overwrite a partial output left behind by a failed attempt
+        '-progress', 'pipe:1', '-nostats', # Machine-readable progress on stdout for the watchdog
+    ]
+    # Input seeking: ffmpeg jumps straight to the slice instead of reading (without reporting progress)
+    # everything before it, so the watchdog only ever waits on the slice's own media. Filtered frames
+    # then start at t=0, matching a re-timed cue file; re-encoded slices stay frame-accurate.
+    slice_command.extend(['-ss', str(start_time), '-i', original_video_path])
+    # Output options apply to one output only, so they are repeated for the HLS output
+    output_seek_args = ['-t', str(slice_duration), '-avoid_negative_ts', 'make_zero']
+    slice_command.extend(output_seek_args)
+
+    output_args, video_filters = slice_output_args(params, loudness, captions_path)
+    slice_command.extend(output_args)
+    slice_command.append(output_slice_path)
+
+    if hls_dir and not is_audio_only(params):
+        slice_command.extend(output_seek_args)
+        slice_command.extend(hls_output_args(params, hls_dir, video_filters, loudness, has_audio=has_audio))
+    return slice_command
+
+def slice_output_args(params, loudness=None, captions_path=None):
+    """
+    FFmpeg output options (codecs, bitrates, filters) for one slice output.
+    Returns them together with the video filters they use, for outputs that derive from the same frames.
+    """
+    output_args = []
+    output_resolution = params.get('output_resolution')
+    video_bitrate = params.get('video_bitrate')
+    audio_bitrate = params.get('audio_bitrate')
+    video_filters = []
+
+    if is_audio_only(params):
+        output_args.append('-vn') # Drop video (and never decode it)
+        audio_format = AUDIO_OUTPUT_FORMATS[params['output_format']]
+        if loudness or audio_bitrate or audio_format['codec'] != 'aac':
+            output_args.extend(audio_encode_args(params, loudness, codec=audio_format['codec']))
+        else:
+            # m4a from an AAC source: a pure remux, the cheapest possible slice
+            output_args.extend(['-c:a', 'copy'])
+
+    elif needs_re_encode(params):
+        output_args.extend(['-c:v', params.get('video_codec', 'libx264')]) # Video codec
+        output_args.extend(audio_encode_args(params, loudness)) # AAC, the standard audio codec for mp4
+
+        # Video Bitrate
+        if video_bitrate:
+            output_args.extend(['-b:v', f"{video_bitrate}k"])
+
+        # Output Resolution and Aspect Ratio
+        if output_resolution and output_resolution not in ['original', '']:
+            width, height = map(int, output_resolution.split('x'))
+            # This filter scales to fit *within* the target dimensions while maintaining aspect ratio,
+            # then crops to exactly the target dimensions (center crop).
+            filter_complex = f"scale='min({width},iw)':min'({height},ih)':force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
+            video_filters.append(filter_complex)
+        else: # Default video quality if re-encoding without explicit settings
+            output_args.extend(['-crf', '23']) # Constant Rate Factor, 0 is lossless, 51 is worst. 23 is good default.
+
+        # Captions are rendered last, so they are sized for the output frame
+        if captions_path:
+            video_filters.append(subtitles_filter(captions_path))
+        if video_filters:
+            output_args.extend(['-vf', ','.join(video_filters)])
+
+    elif loudness:
+        # Only the audio has to change: copy the video stream, re-encode just the audio
+        output_args.extend(['-c:v', 'copy'])
+        output_args.extend(audio_encode_args(params, loudness))
+
+    else:
+        # If no re-encoding is needed, just copy streams for speed
+        output_args.extend(['-c', 'copy'])
+
+    return output_args, video_filters
+
+def build_batch_command(params, original_video_path, cuts, loudness=None):
+    """
+    Builds one FFmpeg command that cuts several adjacent slices, as one output each.
+    cuts is a list of (start_time, slice_duration, output_slice_path). The source is read once,
+    from the first cut on. Only for stream-copied slices (see is_stream_copy): re-encoded outputs
+    would report too little progress for the watchdog.
+    """
+    batch_start = cuts[0][0]
+    batch_command = [
+        'ffmpeg',
+        '-y',
+        '-progress', 'pipe:1', '-nostats',
+        '-ss', str(batch_start), '-i', original_video_path,
+    ]
+    output_args, _ = slice_output_args(params, loudness)
+    for start_time, slice_duration, output_slice_path in cuts:
+        # Output options apply per output, so each output seeks to its own offset into the batch
+        batch_command.extend(['-ss', str(round(start_time - batch_start, 3)), '-t', str(slice_duration),
+                              '-avoid_negative_ts', 'make_zero'])
+        batch_command.extend(output_args)
+        batch_command.append(output_slice_path)
+    return batch_command
+
+def encode_slice_with_retry(job, slice_info, original_video_path, checkpoint=save_job_state):
+    """
+    Encodes one slice, retrying timed-out or killed attempts with exponential backoff. An ffmpeg
+    error exit (bad codec, bad filter, broken input) would only repeat itself, so it is not retried.
+    Updates the slice record and calls checkpoint(job) after every attempt. Returns True on success.
+    """
+    session_dir = os.path.join(TEMP_VIDEO_DIR, job['session_id'])
+    output_slice_path = os.path.join(session_dir, slice_info['filename'])
+    # Written under a temporary name in the final directory, then renamed into place
+    stem, extension = os.path.splitext(slice_info['filename'])
+    partial_slice_path = os.path.join(session_dir, f".{stem}.partial{extension}")
+
+    captions_path = None
+    if slice_info.get('captions') and not is_audio_only(job['params']):
+        captions_path = os.path.join(scratch_dir(job), f"captions_{slice_info['index']}.srt")
+        with open(captions_path, 'w', encoding='utf-8') as f:
+            f.write(format_srt(slice_info['captions']))
+
+    hls_dir = partial_hls_dir = None
+    if job['params'].get('package_hls') and not is_audio_only(job['params']):
+        hls_dir = os.path.join(session_dir, 'hls', stem)
+        partial_hls_dir = os.path.join(session_dir, 'hls', f".{stem}.partial")
+
+    slice_command = build_slice_command(job['params'], original_video_path,
+                                        slice_info['start'], slice_info['duration'], partial_slice_path,
+                                        loudness=job.get('loudness'), captions_path=captions_path, hls_dir=partial_hls_dir,
+                                        has_audio=job.get('has_audio', True))
+
+    mode = encode_mode(job['params'])
+    # The last slice may be shorter than slice_duration
+    media_seconds = slice_info['duration']
+    if job.get('duration'):
+        media_seconds = max(0, min(media_seconds, job['duration'] - slice_info['start']))
+
+    backoff = SLICE_RETRY_BACKOFF_SECONDS
+    deadline = watchdog_deadline(expected_runtime(media_seconds, mode))
+    for attempt in range(SLICE_MAX_ATTEMPTS):
+        slice_info['attempts'] += 1
+        try:
+            if partial_hls_dir:
+                prepare_hls_dir(partial_hls_dir)
+            app.logger.info(f"Slicing command (deadline {deadline:.0f}s): {' '.join(slice_command)}")
+            started = time.monotonic()
+            _, position, io = run_with_watchdog(slice_command, deadline, progress_parser=parse_ffmpeg_progress)
+            record_realtime_factor(mode, position or media_seconds, time.monotonic() - started)
+            slice_info['io'] = add_io(slice_info.get('io') or {}, io)
+            os.replace(partial_slice_path, output_slice_path)
+            if hls_dir:
+                shutil.rmtree(hls_dir, ignore_errors=True)
+                os.replace(partial_hls_dir, hls_dir)
+            app.logger.info(f"Sliced: {output_slice_path}")
+            slice_info['status'] = 'done'
+            slice_info['error'] = None
+            if hls_dir:
+                slice_info['stream'] = True
+            if checkpoint:
+                checkpoint(job)
+            if captions_path and os.path.exists(captions_path):
+                os.remove(captions_path)
+            return True
+        except subprocess.CalledProcessError as e:
+            app.logger.error(f"Slice {slice_info['index']} failed (attempt {attempt + 1}/{SLICE_MAX_ATTEMPTS}): {e.stderr}")
+            slice_info['error'] = (e.stderr or '').strip()[-500:] or f"ffmpeg exited with code {e.returncode}"
+            if e.returncode > 0:
+                slice_info['status'] = 'failed'
+                if checkpoint:
+                    checkpoint(job)
+                return False
+        except subprocess.TimeoutExpired as e:
+            app.logger.error(f"Slice {slice_info['index']} stalled or timed out (attempt {attempt + 1}/{SLICE_MAX_ATTEMPTS})")
+            slice_info['error'] = "Slicing stalled or timed out."
+            if getattr(e, 'reason', None) == 'deadline' and getattr(e, 'position', None):
+                # Still progressing, just slower than expected: learn its real speed and allow for it next time
+                speed = e.position / e.timeout
+                record_realtime_factor(mode, e.position, e.timeout)
+                deadline = max(deadline * 2, watchdog_deadline(media_seconds / speed))
+                app.logger.info(f"Slice {slice_info['index']} ran at {speed:.2f}x realtime; next deadline {deadline:.0f}s")
+
+        slice_info['status'] = 'failed'
+        if checkpoint:
+            checkpoint(job)
+        if attempt + 1 < SLICE_MAX_ATTEMPTS:
+            time.sleep(backoff)
+            backoff *= 2
+
+    return False
+
+def encode_batch(job, batch, original_video_path, checkpoint=save_job_state):
+    """
+    Cuts a batch of adjacent slices (see plan_batches) with a single ffmpeg run, making one attempt.
+    Returns True when every slice was written; otherwise the caller falls back to
+    encode_slice_with_retry for each slice that is not done.
+    """
+    session_dir = os.path.join(TEMP_VIDEO_DIR, job['session_id'])
+    cuts = []
+    renames = []
+    for slice_info in batch:
+        stem, extension = os.path.splitext(slice_info['filename'])
+        partial_slice_path = os.path.join(session_dir, f".{stem}.partial{extension}")
+        cuts.append((slice_info['start'], slice_info['duration'], partial_slice_path))
+        renames.append((partial_slice_path, os.path.join(session_dir, slice_info['filename'])))
+        slice_info['attempts'] += 1
+    batch_command = build_batch_command(job['params'], original_video_path, cuts, loudness=job.get('loudness'))
+
+    mode = encode_mode(job['params'])
+    media_seconds = sum(slice_info['duration'] for slice_info in batch)
+    if job.get('duration'):
+        media_seconds = max(0, min(media_seconds, job['duration'] - batch[0]['start']))
+    indexes = f"{batch[0]['index']}-{batch[-1]['index']}"
+    try:
+        deadline = watchdog_deadline(expected_runtime(media_seconds, mode))
+        app.logger.info(f"Batch slicing command (deadline {deadline:.0f}s): {' '.join(batch_command)}")
+        started = time.monotonic()
+        _, position, io = run_with_watchdog(batch_command, deadline, progress_parser=parse_ffmpeg_progress)
+        # Every output's timestamps start at zero, so the progress position only covers one slice
+        record_realtime_factor(mode, media_seconds, time.monotonic() - started)
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Slices {indexes} failed as a batch; cutting them one by one: {e.stderr}")
+        return False
+    except subprocess.TimeoutExpired:
+        app.logger.error(f"Slices {indexes} stalled or timed out as a batch; cutting them one by one")
+        return False
+
+    for slice_info, (partial_slice_path, output_slice_path) in zip(batch, renames):
+        os.replace(partial_slice_path, output_slice_path)
+        slice_info['status'] = 'done'
+        slice_info['error'] = None
+    # The run's I/O is shared by the whole batch; it is booked on its first slice
+    batch[0]['io'] = add_io(batch[0].get('io') or {}, io)
+    app.logger.info(f"Sliced batch {indexes}")
+    if checkpoint:
+        checkpoint(job)
+    return True
+
+def prepare_source(job):
+    """
+    Gets a job's source ready for slicing: downloads and probes it if that has not happened yet,
+    plans the slices, and runs the per-source loudness and caption steps the job asked for.
+    Returns the path of the source video.
+    """
+    session_id = job['session_id']
+    session_dir = os.path.join(TEMP_VIDEO_DIR, session_id)
+    original_video_path = source_path(job)
+
+    # 1. Download the YouTube video using yt-dlp (again, if a previous run already cleaned it up)
+    if not os.path.exists(original_video_path):
+        job['status'] = 'downloading'
+        original_video_path = reserve_ram_staging(job)
+        save_job_state(job)
+        job['io'] = job.get('io') or {}
+        try:
+            if job['staging'] == 'ram':
+                add_io(job['io'], download_source(job['params'], original_video_path, max_filesize_mb=STAGING_RAM_MAX_SOURCE_MB))
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            release_source(job) # Don't leave partial downloads in RAM
+            raise
+        finally:
+            end_ram_reservation(job)
+        if not os.path.exists(original_video_path):
+            # Too big for RAM (or RAM was not an option): download to disk
+            release_source(job)
+            job.pop('source_path', None)
+            job['staging'] = 'disk'
+            original_video_path = source_path(job)
+            save_job_state(job)
+            add_io(job['io'], download_source(job['params'], original_video_path))
+        add_io(job['io'], {'source_bytes': os.path.getsize(original_video_path)})
+        app.logger.info(f"Source of {session_id} staged on {job['staging']}")
+
+    if MAX_VIDEO_SIZE_BYTES > 0 and os.path.getsize(original_video_path) > MAX_VIDEO_SIZE_BYTES:
+        release_source(job)
+        raise VideoTooLargeError(f"Video file is too large (>{MAX_VIDEO_SIZE_MB}MB). Please choose a shorter video.")
+
+    # 2. Get video duration for slicing (only once; the slice plan is part of the checkpoint)
+    if job['slices'] is None:
+        full_video_duration = probe_duration(original_video_path)
+        app.logger.info(f"Full video duration (of downloaded segment): {full_video_duration} seconds")
+        job['duration'] = full_video_duration
+        job['slices'] = plan_slices(full_video_duration, job['params']['slice_duration'], session_id,
+                                    extension=output_extension(job['params']))
+
+    # HLS renditions map the audio explicitly, so they need to know whether there is any
+    if job['params'].get('package_hls') and 'has_audio' not in job:
+        job['has_audio'] = probe_has_audio(original_video_path)
+
+    # Measure loudness once for the whole source; every slice reuses the result
+    if job['params'].get('normalize_audio') and not job.get('loudness'):
+        job['status'] = 'analyzing'
+        save_job_state(job)
+        job['io'] = job.get('io') or {}
+        job['loudness'] = analyze_loudness(original_video_path, job['duration'], io_totals=job['io'])
+
+    # Look up each slice's cues once; they travel with the slice record (and its distributed task)
+    if job['params'].get('captions') and job.get('captions_status') is None:
+        cue_index = get_cue_index(job['params'], session_dir)
+        if cue_index is None:
+            app.logger.warning(f"No captions available for {job['params']['url']}; continuing without them")
+            job['captions_status'] = 'unavailable'
+            # Nothing to burn in, so slices must not be re-encoded (or get a subtitles filter) for it
+            job['params']['captions'] = False
+        else:
+            source_offset = job['params'].get('download_start_seconds') or 0
+            for slice_info in job['slices']:
+                slice_info['captions'] = slice_captions(cue_index, source_offset, slice_info['start'], slice_info['duration'])
+            job['captions_status'] = 'burned'
+        # The upload is cached and now split across the slices; don't carry it in every checkpoint and task
+        job['params'].pop('captions_text', None)
+        save_job_state(job)
+
+    return original_video_path
+
+def run_job(job, render_locks=False):
+    """
+    Runs (or resumes) a conversion job: prepares the source if that has not happened yet,
+    then encodes every slice that is not already done.
+    render_locks is for resumed lazy jobs: each slice is then encoded under its render lock
+    (see render_lazy_slice), so a render started by a download is never run alongside it.
+    Download and probe errors propagate to the caller; slice errors are recorded per slice.
+    """
+    session_id = job['session_id']
+    session_dir = os.path.join(TEMP_VIDEO_DIR, session_id)
+    original_video_path = prepare_source(job)
+
+    # 3. Slice the video using FFmpeg, skipping slices a previous run already completed
+    if DISTRIBUTED_MODE:
+        # Outputs may live on other nodes, so the task store (not the local disk) decides what is done.
+        # Each node admits the tasks it claims through its own scheduler (see execute_slice_task),
+        # so no slot is held here while waiting on them.
+        job['status'] = 'slicing'
+        save_job_state(job)
+        store = get_task_store()
+        enqueue_job_slices(store, job)
+        start_slice_worker() # This node works on the queue too
+        wait_for_job_slices(store, job)
+    else:
+        remaining_seconds = sum(s['duration'] for s in job['slices'] if s['status'] != 'done')
+        job['status'] = 'queued'
+        save_job_state(job)
+        with scheduled_slot(job, min(remaining_seconds, job['duration'] or remaining_seconds)):
+            job['status'] = 'slicing'
+            save_job_state(job)
+            pending = [s for s in job['slices']
+                       if not (s['status'] == 'done' and os.path.exists(os.path.join(session_dir, s['filename'])))]
+            for slice_info in pending:
+                slice_info['status'] = 'pending'
+            # Only copies are batched: a re-encoding batch reports the progress of one output at a time,
+            # which the watchdog would take for a stall. HLS packages need a command per slice.
+            batchable = (is_stream_copy(job['params'], job.get('loudness')) and not job['params'].get('package_hls')
+                         and not render_locks)
+            succeeded = aborted = False
+            for batch in plan_batches(pending, SLICE_BATCH_MAX_SECONDS if batchable else 0):
+                if aborted:
+                    break
+                if len(batch) > 1 and encode_batch(job, batch, original_video_path):
+                    succeeded = True
+                    continue
+                for slice_info in batch:
+                    if render_locks and encode_unless_rendered(job, slice_info, original_video_path):
+                        succeeded = True
+                    elif not render_locks and encode_slice_with_retry(job, slice_info, original_video_path):
+                        succeeded = True
+                    elif not succeeded:
+                        # Nothing has worked yet, so the rest would most likely fail the same way
+                        app.logger.error(f"Slice {slice_info['index']} failed before any slice succeeded; stopping job {session_id}")
+                        aborted = True
+                        break
+
+    job['status'] = 'complete' if all(s['status'] == 'done' for s in job['slices']) else 'failed'
+    save_job_state(job)
+
+    # The source is only needed again if the job has to be resumed
+    if job['status'] == 'complete':
+        release_source(job)
+
+    return job
+
+def job_response(job):
+    """Builds the JSON response for a finished (or partially finished) job."""
+    session_id = job['session_id']
+    # IMPORTANT: Return relative URLs so they work on the deployed domain
+    download_urls = [f"/download/{session_id}/{s['filename']}" for s in job['slices'] if s['status'] == 'done']
+    # Aligned with downloadUrls; None for segments without an HLS package
+    stream_urls = [stream_url(session_id, s['filename']) if s.get('stream') else None
+                   for s in job['slices'] if s['status'] == 'done']
+    segment_durations = [s['duration'] for s in job['slices'] if s['status'] == 'done']
+
+    if job['status'] == 'complete':
+        return jsonify({"message": "Video processed successfully.", "downloadUrls": download_urls,
+                        "streamUrls": stream_urls, "segmentDurations": segment_durations,
+                        "sessionId": session_id, "io": job_io_totals(job)}), 200
+
+    failed = [s['index'] for s in job['slices'] if s['status'] != 'done']
+    return jsonify({
+        "message": f"{len(failed)} of {len(job['slices'])} segments failed to process. "
+                   f"Completed segments are available; resume the job to retry the rest.",
+        "downloadUrls": download_urls,
+        "streamUrls": stream_urls,
+        "segmentDurations": segment_durations,
+        "failedSegments": failed,
+        "sessionId": session_id,
+        "resumable": True,
+        "io": job_io_totals(job),
+    }), 500
+
+def run_job_and_respond(job, render_locks=False):
+    """Runs a job (or, for a lazy job, just prepares it) and translates any failure into the matching JSON error response."""
+    try:
+        if job.get('lazy'):
+            prepare_source(job)
+            job['status'] = 'planned'
+            return lazy_job_response(job)
+        return job_response(run_job(job, render_locks=render_locks))
+    except VideoTooLargeError as e:
+        return jsonify({"message": str(e)}), 413
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Subprocess failed: {e.cmd}\nSTDOUT: {e.stdout}\nSTDERR: {e.stderr}")
+        return jsonify({"message": f"Video processing failed. Error: {e.stderr.strip()}",
+                        "sessionId": job['session_id'], "resumable": True}), 500
+    except subprocess.TimeoutExpired as e:
+        app.logger.error(f"Subprocess timed out: {e.cmd}")
+        return jsonify({"message": "Video processing timed out. The video might be too long or the server too busy.",
+                        "sessionId": job['session_id'], "resumable": True}), 500
+    except Exception as e:
+        app.logger.error(f"An unexpected error occurred: {e}", exc_info=True)
+        return jsonify({"message": f"An internal server error occurred: {str(e)}"}), 500
+    finally:
+        if job['status'] not in ('complete', 'failed', 'planned'):
+            job['status'] = 'interrupted'
+        try:
+            save_job_state(job)
+        except OSError:
+            app.logger.error(f"Could not checkpoint job {job['session_id']}", exc_info=True)
+
+# --- Distributed Slice Queue ---
+# In DISTRIBUTED_MODE several app instances share a task store (SQLite on a shared volume by
+# default). The node that receives /convert downloads and probes the source, then enqueues one
+# task per slice with itself as the affinity node. Every node runs a slice worker that claims
+# tasks, preferring ones whose source it already holds; tasks left unclaimed for
+# AFFINITY_GRACE_SECONDS (or whose affinity node stopped heartbeating) may be taken by any node,
+# which then downloads its own copy of the source. The store also remembers which node holds
+# each output, so /download can redirect to it.
+
+class TaskStore:
+    """
+    Interface of a shared slice-task store. Implementations must make claim() atomic across
+    processes and nodes. Register new backends in TASK_STORE_BACKENDS.
+    """
 
-        .btn-primary:hover {
-            background: linear-gradient(45deg, var(--secondary-blue) 0%, var(--primary-purple) 100%);
-            transform: translateY(-3px);
-            box-shadow: 0 8px 25px rgba(108, 92, 231, 0.4);
-        }
+    def heartbeat(self, node_id, node_url):
+        """Records that a node is alive and reachable at node_url."""
+        raise NotImplementedError
+
+    def enqueue(self, session_id, slice_index, payload, affinity_node):
+        """Adds (or re-queues, unless already done) the task for one slice."""
+        raise NotImplementedError
+
+    def claim(self, node_id, lease_seconds):
+        """Claims the best available task for node_id. Returns a task dict or None."""
+        raise NotImplementedError
+
+    def renew(self, session_id, slice_index, node_id, lease_seconds):
+        """Extends node_id's lease on a claimed task. Returns False when the task is no longer its own."""
+        raise NotImplementedError
+
+    def finish(self, session_id, slice_index, node_id, status, attempts, error=None, result=None):
+        """
+        Marks a task node_id has claimed as 'done' or 'failed' (a no-op once it is finished or
+        claimed by another node). result holds slice record fields for the job (JSON-able).
+        """
+        raise NotImplementedError
+
+    def session_tasks(self, session_id):
+        """Returns all task dicts for a session, ordered by slice index."""
+        raise NotImplementedError
+
+    def output_node_url(self, session_id, filename):
+        """Returns the base URL of the node that stores a finished output, or None."""
+        raise NotImplementedError
+
+class SQLiteTaskStore(TaskStore):
+    """TaskStore backed by a single SQLite file, which every node must be able to reach."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    session_id TEXT NOT NULL,
+                    slice_index INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    affinity_node TEXT,
+                    node_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    result TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, slice_index)
+                );
+                CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, created_at);
+                CREATE TABLE IF NOT EXISTS nodes (
+                    node_id TEXT PRIMARY KEY,
+                    url TEXT,
+                    heartbeat REAL NOT NULL
+                );
+            """)
+            try:
+                # Stores created before task results were kept
+                conn.execute("ALTER TABLE tasks ADD COLUMN result TEXT")
+            except sqlite3.OperationalError:
+                pass
+
+    def _connect(self):
+        # One short-lived connection per operation keeps this safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return contextlib.closing(conn)
+
+    def heartbeat(self, node_id, node_url):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO nodes (node_id, url, heartbeat) VALUES (?, ?, ?) "
+                         "ON CONFLICT(node_id) DO UPDATE SET url = excluded.url, heartbeat = excluded.heartbeat",
+                         (node_id, node_url, time.time()))
+
+    def enqueue(self, session_id, slice_index, payload, affinity_node):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO tasks (session_id, slice_index, filename, payload, status, affinity_node, created_at) "
+                         "VALUES (?, ?, ?, ?, 'pending', ?, ?) "
+                         "ON CONFLICT(session_id, slice_index) DO UPDATE SET status = 'pending', payload = excluded.payload, "
+                         "affinity_node = excluded.affinity_node, node_id = NULL, lease_expires = NULL, error = NULL, result = NULL, "
+                         "created_at = excluded.created_at WHERE tasks.status != 'done'",
+                         (session_id, slice_index, payload['slice']['filename'], json.dumps(payload),
+                          affinity_node, time.time()))
+
+    def claim(self, node_id, lease_seconds):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("""
+                    SELECT * FROM tasks
+                    WHERE (status = 'pending' OR (status = 'claimed' AND lease_expires < :now))
+                      AND (affinity_node IS NULL OR affinity_node = :node OR created_at < :now - :grace
+                           OR affinity_node NOT IN (SELECT node_id FROM nodes WHERE heartbeat > :now - :dead))
+                    ORDER BY (affinity_node = :node) DESC, created_at, slice_index
+                    LIMIT 1
+                """, {"now": now, "node": node_id, "grace": AFFINITY_GRACE_SECONDS,
+                      "dead": NODE_DEAD_AFTER_SECONDS}).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute("UPDATE tasks SET status = 'claimed', node_id = ?, lease_expires = ? "
+                             "WHERE session_id = ? AND slice_index = ?",
+                             (node_id, now + lease_seconds, row['session_id'], row['slice_index']))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        task = dict(row, status='claimed', node_id=node_id)
+        task['payload'] = json.loads(task['payload'])
+        return task
+
+    def renew(self, session_id, slice_index, node_id, lease_seconds):
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE tasks SET lease_expires = ? "
+                                  "WHERE session_id = ? AND slice_index = ? AND status = 'claimed' AND node_id = ?",
+                                  (time.time() + lease_seconds, session_id, slice_index, node_id))
+            return cursor.rowcount > 0
+
+    def finish(self, session_id, slice_index, node_id, status, attempts, error=None, result=None):
+        with self._connect() as conn:
+            conn.execute("UPDATE tasks SET status = ?, attempts = attempts + ?, error = ?, result = ?, lease_expires = NULL "
+                         "WHERE session_id = ? AND slice_index = ? AND status = 'claimed' AND node_id = ?",
+                         (status, attempts, error, json.dumps(result or {}), session_id, slice_index, node_id))
+
+    def session_tasks(self, session_id):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM tasks WHERE session_id = ? ORDER BY slice_index", (session_id,)).fetchall()
+        tasks = [dict(row) for row in rows]
+        for task in tasks:
+            task['payload'] = json.loads(task['payload'])
+            task['result'] = json.loads(task['result'] or '{}')
+        return tasks
+
+    def output_node_url(self, session_id, filename):
+        with self._connect() as conn:
+            row = conn.execute("SELECT nodes.url FROM tasks JOIN nodes ON nodes.node_id = tasks.node_id "
+                               "WHERE tasks.session_id = ? AND tasks.filename = ? AND tasks.status = 'done'",
+                               (session_id, filename)).fetchone()
+        return row['url'] if row else None
+
+TASK_STORE_BACKENDS = {'sqlite': SQLiteTaskStore}
+_task_store = None
+
+def get_task_store():
+    """Returns this process's TaskStore, created on first use from JOB_STORE_BACKEND / JOB_STORE_PATH."""
+    global _task_store
+    if _task_store is None:
+        _task_store = TASK_STORE_BACKENDS[JOB_STORE_BACKEND](JOB_STORE_PATH)
+    return _task_store
+
+def enqueue_job_slices(store, job):
+    """Queues every slice of a job that is not done yet, with this node as the affinity node."""
+    store.heartbeat(NODE_ID, NODE_URL) # So other nodes respect our affinity right away
+    for slice_info in job['slices']:
+        if slice_info['status'] == 'done':
+            continue
+        slice_info['status'] = 'pending'
+        payload = {"params": job['params'], "duration": job['duration'], "loudness": job.get('loudness'),
+                   "has_audio": job.get('has_audio', True), "source_path": source_path(job), "tenant": job.get('tenant'),
+                   "slice": slice_info}
+        store.enqueue(job['session_id'], slice_info['index'], payload, NODE_ID)
+    save_job_state(job)
+
+def wait_for_job_slices(store, job):
+    """
+    Blocks until no slice of the job is pending or claimed, or DISTRIBUTED_WAIT_SECONDS have passed,
+    then copies task results into the job. Slices still unfinished by then are recorded as failed
+    (resuming the job queues them again).
+    """
+    deadline = time.monotonic() + DISTRIBUTED_WAIT_SECONDS
+    while True:
+        tasks = store.session_tasks(job['session_id'])
+        if all(task['status'] in ('done', 'failed') for task in tasks):
+            break
+        if time.monotonic() > deadline:
+            app.logger.error(f"Gave up waiting on the slices of {job['session_id']} after {DISTRIBUTED_WAIT_SECONDS}s")
+            break
+        time.sleep(DISTRIBUTED_POLL_SECONDS)
+
+    by_index = {task['slice_index']: task for task in tasks}
+    for slice_info in job['slices']:
+        task = by_index.get(slice_info['index'])
+        if task is None:
+            continue
+        slice_info['status'] = task['status']
+        slice_info['attempts'] = task['attempts']
+        slice_info['error'] = task['error']
+        slice_info['node'] = task['node_id']
+        slice_info.update(task['result'])
+        if task['status'] not in ('done', 'failed'):
+            slice_info['status'] = 'failed'
+            slice_info['error'] = "Timed out waiting for a node to process this segment."
+
+def execute_slice_task(store, task):
+    """Encodes one claimed slice task on this node, fetching the source first if it is not cached here."""
+    session_id = task['session_id']
+    payload = task['payload']
+    session_dir = os.path.join(TEMP_VIDEO_DIR, session_id)
+    os.makedirs(session_dir, exist_ok=True)
+    original_video_path = os.path.join(session_dir, 'original_video.mp4')
+    if task['affinity_node'] == NODE_ID and payload.get('source_path') and os.path.exists(payload['source_path']):
+        original_video_path = payload['source_path'] # Our own copy, possibly staged in RAM
 
-        .btn-primary:active {
-            transform: translateY(0);
-            box-shadow: 0 4px 15px rgba(108, 92, 231, 0.2);
-        }
+    if not os.path.exists(original_video_path):
+        # Download under a unique name so concurrent workers on this node never see a partial file
+        partial_path = os.path.join(session_dir, f"original_video.{uuid.uuid4().hex}.mp4")
+        try:
+            download_source(payload['params'], partial_path)
+            os.replace(partial_path, original_video_path)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+            app.logger.error(f"Node {NODE_ID} could not fetch the source of {session_id}: {e}")
+            store.finish(session_id, task['slice_index'], NODE_ID, 'failed', 0, "Could not download the source video.")
+            return
+
+    job = {"session_id": session_id, "params": payload['params'], "duration": payload['duration'],
+           "loudness": payload.get('loudness'), "has_audio": payload.get('has_audio', True),
+           "source_path": original_video_path, "tenant": payload.get('tenant'),
+           "slices": [dict(payload['slice'], attempts=0)]}
+    slice_info = job['slices'][0]
+    # Claimed tasks compete for this node's slots like local jobs, in fair order across tenants
+    with scheduled_slot(job, slice_info['duration']):
+        encode_slice_with_retry(job, slice_info, original_video_path, checkpoint=None)
+    # Fields only the encoding node knows, copied back into the job by wait_for_job_slices
+    result = {key: slice_info[key] for key in ('stream', 'io') if key in slice_info}
+    store.finish(session_id, task['slice_index'], NODE_ID, slice_info['status'], slice_info['attempts'],
+                 slice_info['error'], result=result)
+
+    # A node that only borrowed the source drops its copy once the session has nothing left to do
+    if task['affinity_node'] != NODE_ID and all(t['status'] in ('done', 'failed') for t in store.session_tasks(session_id)):
+        if os.path.exists(original_video_path):
+            os.remove(original_video_path)
 
-        .btn-primary:disabled {
-            background: #cccccc;
-            cursor: not-allowed;
-            box-shadow: none;
-            transform: none;
-            opacity: 0.7;
-        }
+@contextlib.contextmanager
+def renewing_lease(store, task):
+    """Keeps renewing this node's lease on a claimed task for the duration of the block."""
+    done = threading.Event()
+
+    def renew():
+        while not done.wait(TASK_LEASE_RENEW_SECONDS):
+            try:
+                if not store.renew(task['session_id'], task['slice_index'], NODE_ID, TASK_LEASE_SECONDS):
+                    app.logger.warning(f"Node {NODE_ID} lost its lease on slice {task['slice_index']} of {task['session_id']}")
+                    return
+            except sqlite3.Error as e:
+                app.logger.error(f"Could not renew the lease on slice {task['slice_index']} of {task['session_id']}: {e}")
+
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+    try:
+        yield
+    finally:
+        done.set()
+        renewer.join()
+
+def slice_worker_loop(stop_event):
+    """Claims and executes slice tasks from the shared store until stop_event is set."""
+    store = get_task_store()
+    app.logger.info(f"Slice worker started on node {NODE_ID} ({NODE_URL or 'no public URL'})")
+    while not stop_event.is_set():
+        try:
+            store.heartbeat(NODE_ID, NODE_URL)
+            # Leave tasks to other nodes while every slot here is busy, rather than queueing them locally
+            if not get_job_scheduler().has_free_slot():
+                stop_event.wait(DISTRIBUTED_POLL_SECONDS)
+                continue
+            task = store.claim(NODE_ID, TASK_LEASE_SECONDS)
+            if task is None:
+                stop_event.wait(DISTRIBUTED_POLL_SECONDS)
+                continue
+            app.logger.info(f"Node {NODE_ID} claimed slice {task['slice_index']} of {task['session_id']}")
+            with renewing_lease(store, task):
+                try:
+                    execute_slice_task(store, task)
+                except Exception as e:
+                    # Don't leave the task claimed (and the job waiting) until the lease runs out
+                    app.logger.error(f"Slice task {task['slice_index']} of {task['session_id']} failed: {e}", exc_info=True)
+                    store.finish(task['session_id'], task['slice_index'], NODE_ID, 'failed', 0,
+                                 f"Node {NODE_ID} could not process this segment: {e}")
+        except Exception as e:
+            app.logger.error(f"Slice worker error: {e}", exc_info=True)
+            stop_event.wait(DISTRIBUTED_POLL_SECONDS)
+
+_worker_stop = threading.Event()
+_worker_thread = None
+
+def start_slice_worker():
+    """Starts the background slice worker for this process (once). Called from gunicorn's post_fork hook."""
+    global _worker_thread
+    if _worker_thread is None or not _worker_thread.is_alive():
+        _worker_thread = threading.Thread(target=slice_worker_loop, args=(_worker_stop,), daemon=True)
+        _worker_thread.start()
+    return _worker_thread
+
+# --- Lazy Rendering ---
+# A lazy job is prepared up front (download, probe, loudness, captions) but no slice is encoded
+# until its /download URL is first requested. Renders are single-flight: a per-slice file lock
+# makes concurrent requests, from any thread or gunicorn worker on this node, share one encode.
+# With prefetch enabled, rendering slice N also queues slice N+1 in the background.
+
+_prefetch_executor = None
+_prefetch_executor_lock = threading.Lock()
+
+@contextlib.contextmanager
+def session_file_lock(session_id, name, blocking=True):
+    """
+    Holds an exclusive flock on temp_videos/<session>/.<name>.lock for the duration of the block.
+    With blocking=False, raises BlockingIOError instead of waiting when the lock is already held.
+    """
+    lock_path = os.path.join(TEMP_VIDEO_DIR, session_id, f".{name}.lock")
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-        /* Advanced Options Toggle */
-        .advanced-options-toggle {
-            display: flex;
-            align-items: center;
-            margin-top: 1rem;
-            margin-bottom: 1.5rem;
-            color: var(--primary-purple);
-            cursor: pointer;
-            font-weight: 600;
-            font-size: 0.95em;
-            transition: color 0.3s ease;
-        }
-        .advanced-options-toggle:hover {
-            color: var(--secondary-blue);
-        }
-        .advanced-options-toggle input[type="checkbox"] {
-            margin-right: 10px;
-            min-width: 18px; /* Larger checkbox */
-            min-height: 18px;
-            accent-color: var(--primary-purple);
-            cursor: pointer;
-        }
-        .advanced-options-toggle label {
-            margin-bottom: 0;
-            cursor: pointer;
-            font-size: 0.95em; /* Adjust to match checkbox text */
-        }
-        .advanced-options-container {
-            border-top: 1px dashed var(--medium-gray);
-            padding-top: 1.5rem;
-            margin-top: 1.5rem;
-            display: grid; /* Use grid for better layout of form groups */
-            grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); /* 2 columns on wider screens */
-            gap: 1.5rem; /* Spacing between grid items */
-            transition: all 0.5s ease-out;
-            overflow: hidden;
-            max-height: 0;
-            opacity: 0;
-            transform: translateY(10px);
-            pointer-events: none; /* Disable interaction when hidden */
-        }
-        .advanced-options-container.active {
-            max-height: 1000px; /* Arbitrary large value */
-            opacity: 1;
-            transform: translateY(0);
-            pointer-events: all; /* Enable interaction when active */
-        }
+def checkpoint_single_slice(job, slice_info):
+    """
+    Saves one slice's record into the on-disk job state without clobbering slices that other
+    renders updated in the meantime. Removes the source once every slice has been rendered.
+    """
+    session_id = job['session_id']
+    with session_file_lock(session_id, 'state'):
+        current = load_job_state(session_id) or job
+        current['slices'] = [dict(slice_info) if s['index'] == slice_info['index'] else s for s in current['slices']]
+        if all(s['status'] == 'done' for s in current['slices']):
+            current['status'] = 'complete'
+        save_job_state(current)
+
+    if current['status'] == 'complete':
+        release_source(current)
+
+def render_lazy_slice(session_id, filename, prefetch=True):
+    """
+    Renders a lazy job's slice if it has not been rendered yet (single-flight).
+    Returns the slice record, or None when the session has no such lazy slice.
+    """
+    job = load_job_state(session_id)
+    if job is None or not job.get('lazy') or not any(s['filename'] == filename for s in job.get('slices') or ()):
+        return None
 
-        /* Status Messages */
-        .status-message {
-            margin-top: 2rem;
-            padding: 1rem 1.5rem;
-            border-radius: var(--border-radius-sm);
-            text-align: center;
-            font-weight: 500;
-            animation: fadeIn 0.5s ease-out;
-            display: flex; /* For icon alignment */
-            align-items: center;
-            justify-content: center;
-            gap: 10px;
-        }
-        .status-message.loading {
-            background-color: #fff8e1;
-            color: var(--warning-orange);
-            border: 1px solid #ffecb3;
-        }
-        .status-message.success {
-            background-color: #e8f5e9;
-            color: var(--success-green);
-            border: 1px solid #c8e6c9;
-        }
-        .status-message.error {
-            background-color: #ffebee;
-            color: var(--error-red);
-            border: 1px solid #ffcdd2;
-        }
+    with session_file_lock(session_id, f"render_{filename}"):
+        # Re-read under the lock: whoever held it before us may have rendered this slice already
+        job = load_job_state(session_id)
+        if job is None or not job.get('lazy') or not job.get('slices'):
+            return None
+        slice_info = next((s for s in job['slices'] if s['filename'] == filename), None)
+        if slice_info is None:
+            return None
+
+        session_dir = os.path.join(TEMP_VIDEO_DIR, session_id)
+        original_video_path = source_path(job)
+        if slice_info['status'] != 'done' or not os.path.exists(os.path.join(session_dir, filename)):
+            if not os.path.exists(original_video_path):
+                slice_info['status'] = 'failed'
+                slice_info['error'] = "The source video has expired. Resume the job to render the remaining segments."
+                return slice_info
+            os.utime(original_video_path) # Keeps the source from expiring while segments are still wanted
+            app.logger.info(f"Rendering lazy segment {slice_info['index']} of {session_id}")
+            slice_info['status'] = 'pending'
+            with scheduled_slot(job, slice_info['duration']):
+                encode_slice_with_retry(job, slice_info, original_video_path,
+                                        checkpoint=lambda job, slice_info=slice_info: checkpoint_single_slice(job, slice_info))
+
+    if prefetch and job['params'].get('prefetch') and slice_info['status'] == 'done':
+        next_slice = next((s for s in job['slices'] if s['index'] == slice_info['index'] + 1), None)
+        if next_slice is not None and next_slice['status'] != 'done':
+            submit_prefetch(session_id, next_slice['filename'])
+    return slice_info
+
+def encode_unless_rendered(job, slice_info, original_video_path):
+    """
+    Encodes a slice of a resumed lazy job under its render lock. A render triggered by a download
+    may have produced the slice in the meantime; its record is then taken over instead.
+    Returns True when the slice is done.
+    """
+    session_id = job['session_id']
+    with session_file_lock(session_id, f"render_{slice_info['filename']}"):
+        rendered = next((s for s in (load_job_state(session_id) or {}).get('slices') or ()
+                         if s['index'] == slice_info['index'] and s['status'] == 'done'), None)
+        if rendered and os.path.exists(os.path.join(TEMP_VIDEO_DIR, session_id, slice_info['filename'])):
+            slice_info.update(rendered)
+            return True
+        # Per-slice checkpoints, so records saved by renders still finishing are not overwritten
+        return encode_slice_with_retry(job, slice_info, original_video_path,
+                                       checkpoint=lambda job, slice_info=slice_info: checkpoint_single_slice(job, slice_info))
+
+def submit_prefetch(session_id, filename):
+    """Renders a lazy slice in the background, ahead of its first download request."""
+    global _prefetch_executor
+    with _prefetch_executor_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=LAZY_PREFETCH_WORKERS)
+    future = _prefetch_executor.submit(render_lazy_slice, session_id, filename, False)
+    future.add_done_callback(
+        lambda f: f.exception() and app.logger.error(f"Prefetch of {filename} failed: {f.exception()}"))
+
+def lazy_job_response(job):
+    """Builds the JSON response for a planned lazy job: the cut plan and its (not yet rendered) URLs."""
+    session_id = job['session_id']
+    # A lazy segment is rendered on the node holding the job, so point straight at it when distributed
+    base_url = NODE_URL.rstrip('/') if DISTRIBUTED_MODE and NODE_URL else ''
+    packaged = job['params'].get('package_hls') and not is_audio_only(job['params'])
+    plan = [
+        {"index": s['index'], "start": s['start'], "duration": s['duration'],
+         "url": f"{base_url}/download/{session_id}/{s['filename']}",
+         "streamUrl": stream_url(session_id, s['filename'], base_url) if packaged else None}
+        for s in job['slices']
+    ]
+    return jsonify({
+        "message": "Video planned. Each segment is rendered when you first download it.",
+        "downloadUrls": [segment['url'] for segment in plan],
+        "streamUrls": [segment['streamUrl'] for segment in plan],
+        "segmentDurations": [segment['duration'] for segment in plan],
+        "plan": plan,
+        "sessionId": session_id,
+        "lazy": True,
+    }), 200
+
+# --- Frontend Assets ---
+# The page, its CSS and its JS live in FRONTEND_DIR. On the first request each worker builds them
+# once: assets get content-hashed URLs, the page gets those URLs filled in, and every file is kept
+# in memory as identity, gzip and (when the brotli package is installed) brotli variants.
+# Nothing is rendered per request and nothing is done at import time.
+
+_frontend_build = None
+_frontend_build_lock = threading.Lock()
+
+def compress_variants(body):
+    """Returns {content-encoding: bytes} for a file: identity, gzip and, if available, br."""
+    variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    try:
+        import brotli # Optional dependency
+    except ImportError:
+        pass
+    else:
+        variants['br'] = brotli.compress(body, quality=11)
+    # Only keep compressed variants that actually save bytes
+    return {encoding: data for encoding, data in variants.items() if encoding == 'identity' or len(data) < len(body)}
+
+def get_frontend_build():
+    """Builds (once per process) and returns the in-memory frontend: {url path: asset record}."""
+    global _frontend_build
+    with _frontend_build_lock:
+        if _frontend_build is not None:
+            return _frontend_build
+
+        build = {}
+        asset_urls = {}
+        for name in FRONTEND_ASSETS:
+            with open(os.path.join(FRONTEND_DIR, name), 'rb') as f:
+                body = f.read()
+            digest = hashlib.sha256(body).hexdigest()[:12]
+            stem, extension = os.path.splitext(name)
+            url = f"/assets/{stem}.{digest}{extension}"
+            asset_urls[stem + '_' + extension.lstrip('.')] = url
+            build[url] = {
+                "variants": compress_variants(body),
+                "etag": digest,
+                "mimetype": mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                "cache_control": ASSET_CACHE_CONTROL,
+            }
 
-        /* Download Links */
-        .download-links {
-            margin-top: 2rem;
-            padding-top: 1.5rem;
-            border-top: 1px dashed var(--medium-gray);
-            animation: slideInUp 0.7s ease-out;
-        }
-        .download-links h3 {
-            color: var(--primary-purple);
-            font-size: 1.6rem;
-            text-align: center;
-            margin-bottom: 1.5rem;
-        }
-        .download-links p {
-            text-align: center;
-            margin-bottom: 1.5rem;
-            color: #555;
-        }
-        .download-links ul {
-            list-style: none;
-            padding: 0;
-            display: grid;
-            gap: 0.8rem;
-        }
-        .download-links li {
-            background-color: var(--light-gray);
-            padding: 0.8rem 1.2rem;
-            border-radius: var(--border-radius-sm);
-            border: 1px solid var(--medium-gray);
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            transition: background-color 0.2s ease, transform 0.2s ease;
-            box-shadow: 0 2px 10px var(--shadow-light);
-        }
-        .download-links li:hover {
-            background-color: #e0e7ed;
-            transform: translateY(-2px);
-            box-shadow: 0 4px 15px var(--shadow-light);
-        }
-        .download-links a {
-            color: var(--primary-purple);
-            text-decoration: none;
-            font-weight: 500;
-            flex-grow: 1;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        .download-links a:hover {
-            text-decoration: underline;
-            color: var(--secondary-blue);
-        }
-        .download-links a i {
-            font-size: 1.1em;
-            color: var(--secondary-blue);
+        with open(os.path.join(FRONTEND_DIR, 'index.html'), encoding='utf-8') as f:
+            page = f.read()
+        for key, url in asset_urls.items(): # Placeholders like {{ app_css }}; plain substitution, no templating
+            page = page.replace('{{ ' + key + ' }}', url)
+        body = page.encode('utf-8')
+        build['/'] = {
+            "variants": compress_variants(body),
+            "etag": hashlib.sha256(body).hexdigest()[:12],
+            "mimetype": 'text/html; charset=utf-8',
+            "cache_control": 'no-cache', # Always revalidate, so a deploy's new asset URLs are picked up
         }
 
-        /* Animations */
-        @keyframes fadeIn {
-            from { opacity: 0; transform: translateY(10px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        @keyframes slideInUp {
-            from { opacity: 0; transform: translateY(20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
+        _frontend_build = build
+        return build
 
-        /* Responsive Design */
-        @media (max-width: 768px) {
-            .header-content, .footer {
-                padding: 1rem 1.5rem;
-            }
-            .logo {
-                font-size: 1.5rem;
-            }
-            .main-content {
-                padding: 30px 15px;
-            }
-            .container {
-                padding: 30px;
-                border-radius: 10px;
-            }
-            .intro-section h1 {
-                font-size: 2.5rem;
-            }
-            .intro-section p {
-                font-size: 1rem;
-            }
-            h1 { font-size: 2.2rem; margin-bottom: 1.5rem; }
-            h2 { font-size: 1.6rem; margin-bottom: 1.2rem; }
-            h3 { font-size: 1.2rem; margin-bottom: 0.8rem; }
-            .form-group {
-                margin-bottom: 1rem;
-            }
-            label {
-                font-size: 1rem;
-                margin-bottom: 0.5rem;
-            }
-            input[type="url"], input[type="number"], input[type="text"], select, .btn-primary {
-                font-size: 0.95rem;
-                padding: 0.7rem 1rem;
-            }
-            .btn-primary {
-                margin-top: 1rem;
-            }
-            .advanced-options-container {
-                grid-template-columns: 1fr; /* Single column on smaller screens */
-                gap: 1rem;
-            }
-            .download-links h3 {
-                font-size: 1.4rem;
-            }
-            .download-links p {
-                font-size: 0.95rem;
-            }
-        }
+def serve_frontend_file(url):
+    """Serves a built frontend file with content negotiation, ETag revalidation and caching headers."""
+    asset = get_frontend_build().get(url)
+    if asset is None:
+        return jsonify({"message": "File not found or has been removed."}), 404
 
-        @media (max-width: 480px) {
-            .header-content, .footer {
-                padding: 0.8rem 1rem;
-            }
-            .logo {
-                font-size: 1.3rem;
-            }
-            .main-content {
-                padding: 20px 10px;
-            }
-            .container {
-                padding: 20px;
-                border-radius: 8px;
-            }
-            .intro-section h1 {
-                font-size: 2rem;
-            }
-            .intro-section p {
-                font-size: 0.9rem;
-            }
-            h1 { font-size: 1.8rem; margin-bottom: 1.2rem; }
-            h2 { font-size: 1.4rem; margin-bottom: 1rem; }
-            h3 { font-size: 1.1rem; margin-bottom: 0.7rem; }
-            .advanced-options-toggle label {
-                font-size: 0.9em;
-            }
-            .status-message {
-                padding: 0.8rem 1rem;
-                font-size: 0.9em;
-            }
-            .download-links li {
-                padding: 0.7rem 1rem;
-                font-size: 0.9em;
-            }
-        }
-    </style>
-</head>
-<body>
-    <header class="header">
-        <div class="header-content">
-            <h1 class="logo">VideoShaper</h1>
-            <!-- Navigation could go here for a multi-page site -->
-        </div>
-    </header>
-
-    <main class="main-content">
-        <div class="container">
-            <div class="intro-section">
-                <h1>Transform Your Videos into Engaging Shorts!</h1>
-                <p>Easily convert any YouTube video into short, shareable clips. Download full videos or specific segments, then slice them into custom-duration shorts with advanced control over resolution, bitrate, and codec.</p>
-            </div>
-
-            <form id="converterForm">
-                <div class="form-group">
-                    <label for="youtubeUrl">YouTube Video URL:</label>
-                    <input type="url" id="youtubeUrl" placeholder="e.g., https://www.youtube.com/watch?v=dQw4w9WgXcQ" required>
-                </div>
-                <div class="form-group">
-                    <label for="sliceDuration">Slice Duration (seconds):</label>
-                    <input type="number" id="sliceDuration" value="60" min="5" max="600" required>
-                    <small>Enter the desired length of each short video segment (e.g., 15 for 15-second shorts).</small>
-                </div>
-
-                <div class="advanced-options-toggle">
-                    <input type="checkbox" id="toggleAdvancedOptions">
-                    <label for="toggleAdvancedOptions"><i class="fas fa-sliders-h"></i> Show Advanced Options</label>
-                </div>
-
-                <div id="advancedOptions" class="advanced-options-container">
-                    <h2>Customization Settings</h2>
-                    <div class="form-group">
-                        <label for="downloadStartTime">Download Start Time:</label>
-                        <input type="text" id="downloadStartTime" placeholder="e.g., 00:01:30 or 90">
-                        <small>Optional: Start download from this time (HH:MM:SS or seconds).</small>
-                    </div>
-                    <div class="form-group">
-                        <label for="downloadEndTime">Download End Time:</label>
-                        <input type="text" id="downloadEndTime" placeholder="e.g., 00:05:00 or 300">
-                        <small>Optional: End download at this time (HH:MM:SS or seconds).</small>
-                    </div>
-                    <div class="form-group">
-                        <label for="outputResolution">Output Resolution:</label>
-                        <select id="outputResolution">
-                            <option value="">Original (no change)</option>
-                            <option value="1920x1080">1080p (16:9)</option>
-                            <option value="1080x1920">1080p Portrait (9:16) - Ideal for Shorts</option>
-                            <option value="1280x720">720p (16:9)</option>
-                            <option value="720x1280">700p Portrait (9:16)</option>
-                            <option value="854x480">480p (16:9)</option>
-                            <option value="480x854">480p Portrait (9:16)</option>
-                        </select>
-                        <small>Choose resolution. Portrait options are optimized for Shorts. Note: May involve cropping.</small>
-                    </div>
-                    <div class="form-group">
-                        <label for="videoBitrate">Video Bitrate (kbps):</label>
-                        <input type="number" id="videoBitrate" value="" placeholder="e.g., 2000 (for 2Mbps)">
-                        <small>Higher bitrate = better quality, larger file. Leave empty for default (e.g., 2000-5000 for 1080p).</small>
-                    </div>
-                    <div class="form-group">
-                        <label for="audioBitrate">Audio Bitrate (kbps):</label>
-                        <input type="number" id="audioBitrate" value="" placeholder="e.g., 128">
-                        <small>Audio quality. Leave empty for default (e.g., 128, 192, 256).</small>
-                    </div>
-                    <div class="form-group">
-                        <label for="videoCodec">Video Codec:</label>
-                        <select id="videoCodec">
-                            <option value="libx264">H.264 (Default, widely compatible)</option>
-                            <option value="libx265">H.265 / HEVC (More efficient, smaller files, less compatible)</option>
-                        </select>
-                        <small>Choose video compression. H.264 for compatibility, H.265 for efficiency.</small>
-                    </div>
-                </div>
-
-                <button type="submit" id="convertButton" class="btn-primary">Convert to Shorts</button>
-            </form>
-
-            <div id="status" class="status-message" style="display: none;"></div>
-            <div id="downloadLinks" class="download-links" style="display: none;">
-                <h3><i class="fas fa-cloud-download-alt"></i> Your Shorts are Ready!</h3>
-                <p>Click on the links below to download your video segments.</p>
-                <ul>
-                    <!-- Download links will be inserted here by JavaScript -->
-                </ul>
-            </div>
-        </div>
-    </main>
-
-    <footer class="footer">
-        <p>&copy; 2025 VideoShaper. All rights reserved.</p>
-    </footer>
-
-    <script>
-        document.addEventListener('DOMContentLoaded', () => {
-            const form = document.getElementById('converterForm');
-            const youtubeUrlInput = document.getElementById('youtubeUrl');
-            const sliceDurationInput = document.getElementById('sliceDuration');
-            const convertButton = document.getElementById('convertButton');
-            const statusDiv = document.getElementById('status');
-            const downloadLinksDiv = document.getElementById('downloadLinks');
-            const downloadLinksList = downloadLinksDiv.querySelector('ul');
-
-            const toggleAdvancedOptions = document.getElementById('toggleAdvancedOptions');
-            const advancedOptionsContainer = document.getElementById('advancedOptions');
-
-            const downloadStartTimeInput = document.getElementById('downloadStartTime');
-            const downloadEndTimeInput = document.getElementById('downloadEndTime');
-            const outputResolutionSelect = document.getElementById('outputResolution');
-            const videoBitrateInput = document.getElementById('videoBitrate');
-            const audioBitrateInput = document.getElementById('audioBitrate');
-            const videoCodecSelect = document.getElementById('videoCodec');
-
-            // IMPORTANT: API_ENDPOINT is now relative, so it will work on Render's domain.
-            const API_ENDPOINT = '/convert';
-
-            // Toggle advanced options visibility
-            toggleAdvancedOptions.addEventListener('change', () => {
-                if (toggleAdvancedOptions.checked) {
-                    advancedOptionsContainer.classList.add('active');
-                } else {
-                    advancedOptionsContainer.classList.remove('active');
-                }
-            });
-
-
-            form.addEventListener('submit', async (event) => {
-                event.preventDefault();
-
-                const youtubeUrl = youtubeUrlInput.value.trim();
-                const sliceDuration = parseInt(sliceDurationInput.value, 10);
-
-                if (!youtubeUrl || !sliceDuration || isNaN(sliceDuration) || sliceDuration < 5) {
-                    displayStatus('<i class="fas fa-exclamation-circle"></i> Please provide a valid YouTube URL and a slice duration of at least 5 seconds.', 'error');
-                    return;
-                }
-
-                convertButton.disabled = true;
-                convertButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Processing...';
-
-                displayStatus('<i class="fas fa-hourglass-half"></i> Processing your video... This may take a while depending on video length, server load, and chosen quality settings (re-encoding takes longer).', 'loading');
-                downloadLinksDiv.style.display = 'none';
-                downloadLinksList.innerHTML = '';
-
-                const requestBody = {
-                    url: youtubeUrl,
-                    duration: sliceDuration,
-                    // Advanced options
-                    download_start_time: downloadStartTimeInput.value.trim(),
-                    download_end_time: downloadEndTimeInput.value.trim(),
-                    output_resolution: outputResolutionSelect.value,
-                    video_bitrate: videoBitrateInput.value.trim(),
-                    audio_bitrate: audioBitrateInput.value.trim(),
-                    video_codec: videoCodecSelect.value,
-                };
-
-                try {
-                    const response = await fetch(API_ENDPOINT, {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify(requestBody),
-                    });
-
-                    const result = await response.json();
-
-                    if (response.ok) {
-                        if (result.downloadUrls && Array.isArray(result.downloadUrls) && result.downloadUrls.length > 0) {
-                            displayStatus('<i class="fas fa-check-circle"></i> Video successfully processed! Your shorts are ready.', 'success');
-                            result.downloadUrls.forEach((url, index) => {
-                                const listItem = document.createElement('li');
-                                const link = document.createElement('a');
-                                link.href = url; // These URLs are now relative from the backend
-                                link.innerHTML = `<i class="fas fa-film"></i> Short Segment ${index + 1} (${sliceDuration}s)`;
-                                link.download = `youtube_short_segment_${index + 1}.mp4`;
-                                listItem.appendChild(link);
-                                downloadLinksList.appendChild(listItem);
-                            });
-                            downloadLinksDiv.style.display = 'block';
-                        } else if (result.message) {
-                            displayStatus(`<i class="fas fa-info-circle"></i> Processing finished: ${result.message}`, 'success');
-                        } else {
-                            displayStatus('<i class="fas fa-exclamation-circle"></i> Processing finished, but no download links were returned.', 'error');
-                        }
-                    } else {
-                        displayStatus(`<i class="fas fa-times-circle"></i> Error: ${result.message || 'Something went wrong on the server.'}`, 'error');
-                    }
-                } catch (error) {
-                    console.error('Fetch error:', error);
-                    displayStatus(`<i class="fas fa-times-circle"></i> Network error or server unavailable: ${error.message}. Please ensure your backend service is running.`, 'error');
-                } finally {
-                    convertButton.disabled = false;
-                    convertButton.innerHTML = 'Convert to Shorts';
-                }
-            });
-
-            function displayStatus(message, type) {
-                statusDiv.innerHTML = message;
-                statusDiv.className = `status-message ${type}`;
-                statusDiv.style.display = 'flex'; // Use flex for icon alignment
-                if (type === 'loading' || type === 'error') {
-                    downloadLinksDiv.style.display = 'none';
-                    downloadLinksList.innerHTML = '';
-                }
-            }
-        });
-    </script>
-</body>
-</html>
-"""
+    accepted = {part.split(';')[0].strip() for part in request.headers.get('Accept-Encoding', '').split(',')}
+    encoding = next((e for e in ('br', 'gzip') if e in accepted and e in asset['variants']), 'identity')
+    etag = asset['etag'] if encoding == 'identity' else f"{asset['etag']}-{encoding}"
 
-# --- Helper Functions ---
-def parse_time_to_seconds(time_str):
-    """
-    Parses a time string (HH:MM:SS or seconds) into total seconds.
-    Returns None if parsing fails.
-    """
-    if not time_str:
-        return None
-    try:
-        # Check if it's already an integer (seconds)
-        return int(time_str)
-    except ValueError:
-        # Try to parse as HH:MM:SS
-        parts = list(map(int, time_str.split(':')))
-        if len(parts) == 3:
-            return parts[0] * 3600 + parts[1] * 60 + parts[2]
-        elif len(parts) == 2: # MM:SS
-            return parts[0] * 60 + parts[1]
-        elif len(parts) == 1: # S or SS
-             return parts[0]
-        return None
+    headers = {"ETag": f'"{etag}"', "Cache-Control": asset['cache_control'], "Vary": 'Accept-Encoding'}
+    client_etags = {tag.strip().removeprefix('W/').strip('"') for tag in request.headers.get('If-None-Match', '').split(',')}
+    if etag in client_etags:
+        return Response(status=304, headers=headers)
+    if encoding != 'identity':
+        headers["Content-Encoding"] = encoding
+    return Response(asset['variants'][encoding], mimetype=asset['mimetype'], headers=headers)
 
 # --- Flask Routes (Backend Logic) ---
 
 @app.route('/')
 def index():
     """Serves the main HTML page."""
-    return render_template_string(HTML_PAGE)
+    return serve_frontend_file('/')
+
+@app.route('/assets/<filename>')
+def frontend_asset(filename):
+    """Serves the content-hashed CSS/JS of the main page."""
+    return serve_frontend_file(f"/assets/{filename}")
 
 @app.route('/convert', methods=['POST'])
 def convert_video():
@@ -733,6 +2085,14 @@ def convert_video():
     video_bitrate_str = data.get('video_bitrate')
     audio_bitrate_str = data.get('audio_bitrate')
     video_codec = data.get('video_codec', 'libx264') # Default to libx264 if not specified
+    output_format = data.get('output_format') or 'mp4' # 'mp4' for video shorts, or an audio-only format
+    normalize_audio = bool(data.get('normalize_audio'))
+    captions_text = data.get('captions_text') # Contents of an uploaded .srt/.vtt file
+    lazy = bool(data.get('lazy')) # Render each segment only when it is first downloaded
+    prefetch = bool(data.get('prefetch')) # With lazy: also render the next segment ahead of time
+    package_hls = bool(data.get('package_hls')) # Also write each segment as HLS for in-browser previews
+    captions = bool(data.get('captions') or captions_text)
+    caption_language = data.get('caption_language') or 'en'
 
     if not youtube_url or not slice_duration_str:
         return jsonify({"message": "Missing YouTube URL or slice duration."}), 400
@@ -751,6 +2111,22 @@ def convert_video():
     if output_resolution and 'x' not in output_resolution and output_resolution not in ['original', '']:
         return jsonify({"message": "Invalid output resolution format. Use WIDTHxHEIGHT (e.g., 1920x1080)."}), 400
 
+    if output_format != 'mp4' and output_format not in AUDIO_OUTPUT_FORMATS:
+        return jsonify({"message": f"Invalid output format. Use one of: mp4, {', '.join(AUDIO_OUTPUT_FORMATS)}."}), 400
+
+    if package_hls and output_format != 'mp4':
+        return jsonify({"message": "Streaming packages are only available for video (mp4) output."}), 400
+
+    if captions:
+        if output_format != 'mp4':
+            return jsonify({"message": "Captions can only be burned into video (mp4) output."}), 400
+        if captions_text and len(captions_text.encode('utf-8')) > MAX_CAPTIONS_UPLOAD_BYTES:
+            return jsonify({"message": "Caption file is too large."}), 400
+        if captions_text and not parse_captions(captions_text):
+            return jsonify({"message": "Could not read any cues from the caption file. Use .srt or .vtt."}), 400
+        if not re.fullmatch(r'[A-Za-z0-9_.*-]+', caption_language):
+            return jsonify({"message": "Invalid caption language code."}), 400
+
     # Validate bitrates
     video_bitrate = None
     if video_bitrate_str:
@@ -770,123 +2146,104 @@ def convert_video():
         except ValueError:
             return jsonify({"message": "Invalid audio bitrate. Must be a number."}), 400
 
+    expire_idle_sources()
     session_id = str(uuid.uuid4())
     session_dir = os.path.join(TEMP_VIDEO_DIR, session_id)
     os.makedirs(session_dir, exist_ok=True)
 
-    original_video_path = os.path.join(session_dir, 'original_video.mp4')
-    download_urls = []
-
-    try:
-        # 1. Download the YouTube video using yt-dlp
-        app.logger.info(f"Downloading {youtube_url} to {original_video_path}")
-        download_command = [
-            'yt-dlp',
-            '-f', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]',
-            '--merge-output-format', 'mp4',
-            '--restrict-filenames',
-            '-o', original_video_path,
-        ]
+    job = {
+        "session_id": session_id,
+        "status": "created",
+        "tenant": request_tenant(),
+        "params": {
+            "url": youtube_url,
+            "slice_duration": slice_duration,
+            "download_start_seconds": download_start_seconds,
+            "download_end_seconds": download_end_seconds,
+            "output_resolution": output_resolution,
+            "video_bitrate": video_bitrate,
+            "audio_bitrate": audio_bitrate,
+            "video_codec": video_codec,
+            "output_format": output_format,
+            "normalize_audio": normalize_audio,
+            "captions": captions,
+            "caption_language": caption_language,
+            "captions_text": captions_text,
+            "prefetch": prefetch,
+            "package_hls": package_hls,
+        },
+        "lazy": lazy,
+        "duration": None,
+        "loudness": None,
+        "captions_status": None,
+        "slices": None,
+    }
+    # Held while the job runs, so a resume of this session cannot run alongside it
+    with session_file_lock(session_id, 'job'):
+        save_job_state(job)
+        return run_job_and_respond(job)
+
+@app.route('/resume/<session_id>', methods=['POST'])
+def resume_job(session_id):
+    """
+    Resumes an interrupted or partially failed job from its last completed slice.
+    """
+    if ".." in session_id or "/" in session_id or "\\" in session_id:
+        return jsonify({"message": "Invalid session id."}), 400
 
-        # Add download sections if specified
-        if download_start_seconds is not None and download_end_seconds is not None:
-            download_command.extend(['--download-sections', f"*{download_start_seconds}-{download_end_seconds}"])
-        elif download_start_seconds is not None:
-            download_command.extend(['--download-sections', f"*{download_start_seconds}-inf"])
-        elif download_end_seconds is not None:
-            download_command.extend(['--download-sections', f"*0-{download_end_seconds}"])
-
-        download_command.append(youtube_url)
-
-        subprocess.run(download_command, check=True, capture_output=True, text=True, timeout=600) # 10 minutes timeout for download
-        app.logger.info(f"Download complete: {original_video_path}")
-
-        if MAX_VIDEO_SIZE_BYTES > 0 and os.path.getsize(original_video_path) > MAX_VIDEO_SIZE_BYTES:
-            return jsonify({"message": f"Video file is too large (>{MAX_VIDEO_SIZE_MB}MB). Please choose a shorter video."}), 413
-
-        # 2. Get video duration for slicing
-        probe_command = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            original_video_path
-        ]
-        duration_output = subprocess.run(probe_command, check=True, capture_output=True, text=True, timeout=60)
-        full_video_duration = float(duration_output.stdout.strip())
-        app.logger.info(f"Full video duration (of downloaded segment): {full_video_duration} seconds")
+    if load_job_state(session_id) is None:
+        return jsonify({"message": "Job not found or has been removed."}), 404
 
-        # 3. Slice the video using FFmpeg
-        num_slices = int(full_video_duration / slice_duration)
-        if full_video_duration % slice_duration != 0:
-            num_slices += 1
-
-        # Determine if re-encoding is needed
-        re_encode = bool(output_resolution or video_bitrate or audio_bitrate or video_codec != 'libx264')
-
-        for i in range(num_slices):
-            start_time = i * slice_duration
-            current_slice_duration = slice_duration # FFmpeg handles the end gracefully
-
-            output_slice_filename = f"short_segment_{i+1}_{session_id}.mp4"
-            output_slice_path = os.path.join(session_dir, output_slice_filename)
-
-            slice_command = [
-                'ffmpeg',
-                '-i', original_video_path,
-                '-ss', str(start_time),
-                '-t', str(current_slice_duration),
-                '-avoid_negative_ts', 'make_zero',
-            ]
-
-            if re_encode:
-                slice_command.extend(['-c:v', video_codec]) # Video codec
-                slice_command.extend(['-c:a', 'aac']) # Standard audio codec for mp4
-
-                # Video Bitrate
-                if video_bitrate:
-                    slice_command.extend(['-b:v', f"{video_bitrate}k"])
-                # Audio Bitrate
-                if audio_bitrate:
-                    slice_command.extend(['-b:a', f"{audio_bitrate}k"])
-
-                # Output Resolution and Aspect Ratio
-                if output_resolution and output_resolution not in ['original', '']:
-                    width, height = map(int, output_resolution.split('x'))
-                    # This filter scales to fit *within* the target dimensions while maintaining aspect ratio,
-                    # then crops to exactly the target dimensions (center crop).
-                    filter_complex = f"scale='min({width},iw)':min'({height},ih)':force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
-                    slice_command.extend(['-vf', filter_complex])
-                else: # Default video quality if re-encoding without explicit settings
-                    slice_command.extend(['-crf', '23']) # Constant Rate Factor, 0 is lossless, 51 is worst. 23 is good default.
-
-            else:
-                # If no re-encoding is needed, just copy streams for speed
-                slice_command.extend(['-c', 'copy'])
-
-            slice_command.append(output_slice_path)
-
-            app.logger.info(f"Slicing command: {' '.join(slice_command)}")
-            subprocess.run(slice_command, check=True, capture_output=True, text=True, timeout=600) # 10 minutes timeout for slicing
-            app.logger.info(f"Sliced: {output_slice_path}")
-            # IMPORTANT: Return relative URLs so they work on the deployed domain
-            download_urls.append(f"/download/{session_id}/{output_slice_filename}")
+    try:
+        with session_file_lock(session_id, 'job', blocking=False):
+            # Read under the lock: a run that just finished may have completed more slices
+            job = load_job_state(session_id)
+            if job['status'] == 'complete':
+                return job_response(job)
+            was_lazy = bool(job.get('lazy'))
+            if was_lazy:
+                # Lazy segments render on download; resuming renders all of the ones still missing
+                job['lazy'] = False
+
+            app.logger.info(f"Resuming job {session_id} (status: {job['status']})")
+            return run_job_and_respond(job, render_locks=was_lazy)
+    except BlockingIOError:
+        return jsonify({"message": "This job is still being processed. Try resuming it once it has finished.",
+                        "sessionId": session_id}), 409
+
+@app.route('/jobs/<session_id>')
+def job_status(session_id):
+    """
+    Returns the checkpointed state of a job, including per-slice status.
+    """
+    if ".." in session_id or "/" in session_id or "\\" in session_id:
+        return jsonify({"message": "Invalid session id."}), 400
 
-        return jsonify({"message": "Video processed successfully.", "downloadUrls": download_urls}), 200
+    job = load_job_state(session_id)
+    if job is None:
+        return jsonify({"message": "Job not found or has been removed."}), 404
+    return jsonify(job), 200
 
-    except subprocess.CalledProcessError as e:
-        app.logger.error(f"Subprocess failed: {e.cmd}\nSTDOUT: {e.stdout}\nSTDERR: {e.stderr}")
-        return jsonify({"message": f"Video processing failed. Error: {e.stderr.strip()}"}), 500
-    except subprocess.TimeoutExpired as e:
-        app.logger.error(f"Subprocess timed out: {e.cmd}")
-        return jsonify({"message": "Video processing timed out. The video might be too long or the server too busy."}), 500
-    except Exception as e:
-        app.logger.error(f"An unexpected error occurred: {e}", exc_info=True)
-        return jsonify({"message": f"An internal server error occurred: {str(e)}"}), 500
-    finally:
-        if os.path.exists(original_video_path):
-            os.remove(original_video_path)
-            app.logger.info(f"Removed original video: {original_video_path}")
+@app.route('/metrics')
+def metrics():
+    """
+    Exposes watchdog counters (stalls, deadline kills, ...) and the current realtime-factor estimates.
+    """
+    with _realtime_lock:
+        modes = list(_realtime_history)
+    with _metrics_lock:
+        counters = dict(watchdog_metrics)
+    return jsonify({
+        "watchdog": counters,
+        "realtimeFactors": {mode: expected_realtime_factor(mode) for mode in modes},
+    }), 200
+
+@app.route('/scheduler')
+def scheduler_status():
+    """
+    Exposes the node's scheduling queue and per-tenant wait times, for tuning.
+    """
+    return jsonify(get_job_scheduler().snapshot()), 200
 
 @app.route('/download/<session_id>/<filename>')
 def download_file(session_id, filename):
@@ -897,6 +2254,16 @@ def download_file(session_id, filename):
         return jsonify({"message": "Invalid filename."}), 400
 
     file_path = os.path.join(TEMP_VIDEO_DIR, session_id, filename)
+    if not os.path.exists(file_path) and DISTRIBUTED_MODE and ".." not in session_id and "/" not in session_id:
+        # The segment may have been encoded by another node; send the client there
+        node_url = get_task_store().output_node_url(session_id, filename)
+        if node_url and node_url.rstrip('/') != (NODE_URL or '').rstrip('/'):
+            return redirect(f"{node_url.rstrip('/')}/download/{session_id}/{filename}", code=302)
+    if not os.path.exists(file_path) and ".." not in session_id and "/" not in session_id:
+        # Lazy jobs render a segment on its first download
+        slice_info = render_lazy_slice(session_id, filename)
+        if slice_info is not None and slice_info['status'] != 'done':
+            return jsonify({"message": f"Rendering this segment failed. Error: {slice_info['error']}"}), 500
     if not os.path.exists(file_path):
         return jsonify({"message": "File not found or has been removed."}), 404
 
@@ -906,6 +2273,42 @@ def download_file(session_id, filename):
         as_attachment=True
     )
 
+@app.route('/stream/<session_id>/<path:subpath>')
+def stream_file(session_id, subpath):
+    """
+    Serves a segment's HLS playlists and media fragments inline, for in-browser previews.
+    """
+    if ".." in session_id or "/" in session_id or "\\" in session_id or ".." in subpath or "\\" in subpath:
+        return jsonify({"message": "Invalid path."}), 400
+
+    hls_root = os.path.join(TEMP_VIDEO_DIR, session_id, 'hls')
+    segment_filename = f"{subpath.split('/')[0]}.mp4"
+    if not os.path.exists(os.path.join(hls_root, subpath)):
+        if DISTRIBUTED_MODE:
+            # The segment may have been packaged by another node; send the player there
+            node_url = get_task_store().output_node_url(session_id, segment_filename)
+            if node_url and node_url.rstrip('/') != (NODE_URL or '').rstrip('/'):
+                return redirect(f"{node_url.rstrip('/')}/stream/{session_id}/{subpath}", code=302)
+        # Lazy jobs render (and package) a segment on its first request
+        slice_info = render_lazy_slice(session_id, segment_filename)
+        if slice_info is not None and slice_info['status'] != 'done':
+            return jsonify({"message": f"Rendering this segment failed. Error: {slice_info['error']}"}), 500
+    if not os.path.exists(os.path.join(hls_root, subpath)):
+        return jsonify({"message": "File not found or has been removed."}), 404
+
+    return send_from_directory(
+        directory=hls_root,
+        path=subpath,
+        mimetype=HLS_MIMETYPES.get(os.path.splitext(subpath)[1], 'application/octet-stream'),
+    )
+
 if __name__ == '__main__':
-    # Only run in debug mode locally. Render will use Gunicorn.
-    app.run(debug=True, port=os.environ.get('PORT', 5000))
+    import sys
+    if sys.argv[1:] == ['worker']:
+        # `python app.py worker`: a headless node that only processes slice tasks from the shared store
+        slice_worker_loop(_worker_stop)
+    else:
+        if DISTRIBUTED_MODE:
+            start_slice_worker()
+        # Only run in debug mode locally. Render will use Gunicorn.
+        app.run(debug=True, port=os.environ.get('PORT', 5000))
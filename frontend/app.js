@@ -0,0 +1,213 @@
+document.addEventListener('DOMContentLoaded', () => {
+    const form = document.getElementById('converterForm');
+    const youtubeUrlInput = document.getElementById('youtubeUrl');
+    const sliceDurationInput = document.getElementById('sliceDuration');
+    const convertButton = document.getElementById('convertButton');
+    const statusDiv = document.getElementById('status');
+    const downloadLinksDiv = document.getElementById('downloadLinks');
+    const downloadLinksList = downloadLinksDiv.querySelector('ul');
+
+    const toggleAdvancedOptions = document.getElementById('toggleAdvancedOptions');
+    const advancedOptionsContainer = document.getElementById('advancedOptions');
+
+    const downloadStartTimeInput = document.getElementById('downloadStartTime');
+    const downloadEndTimeInput = document.getElementById('downloadEndTime');
+    const outputResolutionSelect = document.getElementById('outputResolution');
+    const videoBitrateInput = document.getElementById('videoBitrate');
+    const audioBitrateInput = document.getElementById('audioBitrate');
+    const videoCodecSelect = document.getElementById('videoCodec');
+    const outputFormatSelect = document.getElementById('outputFormat');
+    const normalizeAudioInput = document.getElementById('normalizeAudio');
+    const burnCaptionsInput = document.getElementById('burnCaptions');
+    const lazyRenderInput = document.getElementById('lazyRender');
+    const packageHlsInput = document.getElementById('packageHls');
+    const captionLanguageInput = document.getElementById('captionLanguage');
+    const captionFileInput = document.getElementById('captionFile');
+
+    // IMPORTANT: API_ENDPOINT is now relative, so it will work on Render's domain.
+    const API_ENDPOINT = '/convert';
+
+    // Toggle advanced options visibility
+    toggleAdvancedOptions.addEventListener('change', () => {
+        if (toggleAdvancedOptions.checked) {
+            advancedOptionsContainer.classList.add('active');
+        } else {
+            advancedOptionsContainer.classList.remove('active');
+        }
+    });
+
+
+    form.addEventListener('submit', async (event) => {
+        event.preventDefault();
+
+        const youtubeUrl = youtubeUrlInput.value.trim();
+        const sliceDuration = parseInt(sliceDurationInput.value, 10);
+
+        if (!youtubeUrl || !sliceDuration || isNaN(sliceDuration) || sliceDuration < 5) {
+            displayStatus('<i class="fas fa-exclamation-circle"></i> Please provide a valid YouTube URL and a slice duration of at least 5 seconds.', 'error');
+            return;
+        }
+
+        convertButton.disabled = true;
+        convertButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Processing...';
+
+        displayStatus('<i class="fas fa-hourglass-half"></i> Processing your video... This may take a while depending on video length, server load, and chosen quality settings (re-encoding takes longer).', 'loading');
+        downloadLinksDiv.style.display = 'none';
+        downloadLinksList.innerHTML = '';
+
+        const requestBody = {
+            url: youtubeUrl,
+            duration: sliceDuration,
+            // Advanced options
+            download_start_time: downloadStartTimeInput.value.trim(),
+            download_end_time: downloadEndTimeInput.value.trim(),
+            output_resolution: outputResolutionSelect.value,
+            video_bitrate: videoBitrateInput.value.trim(),
+            audio_bitrate: audioBitrateInput.value.trim(),
+            video_codec: videoCodecSelect.value,
+            output_format: outputFormatSelect.value,
+            normalize_audio: normalizeAudioInput.checked,
+            captions: burnCaptionsInput.checked,
+            caption_language: captionLanguageInput.value.trim(),
+            lazy: lazyRenderInput.checked,
+            prefetch: lazyRenderInput.checked,
+            package_hls: packageHlsInput.checked,
+        };
+        if (captionFileInput.files.length > 0) {
+            requestBody.captions_text = await captionFileInput.files[0].text();
+        }
+
+        await submitJob(API_ENDPOINT, requestBody, sliceDuration);
+    });
+
+    // Sends a job request (new conversion or resume) and renders the result.
+    async function submitJob(endpoint, requestBody, sliceDuration) {
+        try {
+            const response = await fetch(endpoint, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify(requestBody),
+            });
+
+            const result = await response.json();
+
+            if (response.ok) {
+                if (result.downloadUrls && Array.isArray(result.downloadUrls) && result.downloadUrls.length > 0) {
+                    if (result.lazy) {
+                        displayStatus('<i class="fas fa-check-circle"></i> Video ready! Each short is rendered when you click it, so the first download of a segment may take a moment.', 'success');
+                    } else {
+                        displayStatus('<i class="fas fa-check-circle"></i> Video successfully processed! Your shorts are ready.', 'success');
+                    }
+                    renderDownloadLinks(result.downloadUrls, sliceDuration, result.streamUrls, result.segmentDurations);
+                } else if (result.message) {
+                    displayStatus(`<i class="fas fa-info-circle"></i> Processing finished: ${result.message}`, 'success');
+                } else {
+                    displayStatus('<i class="fas fa-exclamation-circle"></i> Processing finished, but no download links were returned.', 'error');
+                }
+            } else {
+                displayStatus(`<i class="fas fa-times-circle"></i> Error: ${result.message || 'Something went wrong on the server.'}`, 'error');
+                if (result.resumable && result.sessionId) {
+                    // Keep whatever segments did finish, and offer to retry the rest.
+                    if (result.downloadUrls && result.downloadUrls.length > 0) {
+                        renderDownloadLinks(result.downloadUrls, sliceDuration, result.streamUrls, result.segmentDurations);
+                    }
+                    const resumeButton = document.createElement('button');
+                    resumeButton.type = 'button';
+                    resumeButton.className = 'btn-primary';
+                    resumeButton.innerHTML = '<i class="fas fa-redo"></i> Resume Job';
+                    resumeButton.addEventListener('click', async () => {
+                        resumeButton.disabled = true;
+                        displayStatus('<i class="fas fa-hourglass-half"></i> Resuming your job from the last completed segment...', 'loading');
+                        await submitJob(`/resume/${result.sessionId}`, {}, sliceDuration);
+                    });
+                    statusDiv.appendChild(resumeButton);
+                }
+            }
+        } catch (error) {
+            console.error('Fetch error:', error);
+            displayStatus(`<i class="fas fa-times-circle"></i> Network error or server unavailable: ${error.message}. Please ensure your backend service is running.`, 'error');
+        } finally {
+            convertButton.disabled = false;
+            convertButton.innerHTML = 'Convert to Shorts';
+        }
+    }
+
+    function renderDownloadLinks(downloadUrls, sliceDuration, streamUrls, segmentDurations) {
+        downloadLinksList.innerHTML = '';
+        downloadUrls.forEach((url, index) => {
+            // Segment numbers come from the URL so gaps left by failed segments stay visible
+            const match = url.match(/short_segment_(\d+)_.*\.(\w+)$/);
+            const segmentNumber = match ? match[1] : downloadLinksList.children.length + 1;
+            const extension = match ? match[2] : 'mp4';
+            const listItem = document.createElement('li');
+            const link = document.createElement('a');
+            link.href = url; // These URLs are now relative from the backend
+            // The last segment can be longer (a short tail is merged into it) or all can be evened out
+            const duration = segmentDurations ? Math.round(segmentDurations[index]) : sliceDuration;
+            link.innerHTML = `<i class="fas fa-film"></i> Short Segment ${segmentNumber} (${duration}s)`;
+            link.download = `youtube_short_segment_${segmentNumber}.${extension}`;
+            listItem.appendChild(link);
+
+            const streamUrl = streamUrls && streamUrls[index];
+            if (streamUrl) {
+                const previewButton = document.createElement('button');
+                previewButton.type = 'button';
+                previewButton.className = 'preview-button';
+                previewButton.innerHTML = '<i class="fas fa-play-circle"></i> Preview';
+                previewButton.addEventListener('click', () => {
+                    previewButton.remove();
+                    playPreview(listItem, streamUrl);
+                });
+                listItem.appendChild(previewButton);
+            }
+            downloadLinksList.appendChild(listItem);
+        });
+        downloadLinksDiv.style.display = 'block';
+    }
+
+    // Streams a segment's HLS package: natively where supported (Safari), otherwise through hls.js,
+    // which is only fetched the first time a preview is opened.
+    let hlsLibrary = null;
+    async function playPreview(container, streamUrl) {
+        const video = document.createElement('video');
+        video.controls = true;
+        video.autoplay = true;
+        video.playsInline = true;
+        container.appendChild(video);
+
+        if (video.canPlayType('application/vnd.apple.mpegurl')) {
+            video.src = streamUrl;
+            return;
+        }
+        if (!hlsLibrary) {
+            hlsLibrary = new Promise((resolve, reject) => {
+                const script = document.createElement('script');
+                script.src = 'https://cdn.jsdelivr.net/npm/hls.js@1/dist/hls.min.js';
+                script.onload = () => resolve(window.Hls);
+                script.onerror = reject;
+                document.head.appendChild(script);
+            });
+        }
+        try {
+            const Hls = await hlsLibrary;
+            const player = new Hls();
+            player.loadSource(streamUrl);
+            player.attachMedia(video);
+        } catch (error) {
+            console.error('Preview error:', error);
+            video.remove();
+        }
+    }
+
+    function displayStatus(message, type) {
+        statusDiv.innerHTML = message;
+        statusDiv.className = `status-message ${type}`;
+        statusDiv.style.display = 'flex'; // Use flex for icon alignment
+        if (type === 'loading' || type === 'error') {
+            downloadLinksDiv.style.display = 'none';
+            downloadLinksList.innerHTML = '';
+        }
+    }
+});
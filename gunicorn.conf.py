@@ -0,0 +1,7 @@
+# Gunicorn picks this file up automatically (gunicorn app:app).
+
+def post_fork(server, worker):
+    # In distributed mode every worker process also pulls slice tasks from the shared store.
+    import app
+    if app.DISTRIBUTED_MODE:
+        app.start_slice_worker()
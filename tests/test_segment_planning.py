@@ -0,0 +1,80 @@
+import pytest
+
+from app import plan_batches, plan_segments, plan_slices
+
+
+def test_exact_multiple_has_no_tail():
+    assert plan_segments(60, 30, min_tail=10) == [(0, 30), (30, 30)]
+
+
+def test_long_tail_is_kept():
+    assert plan_segments(75, 30, min_tail=10) == [(0, 30), (30, 30), (60, 15)]
+
+
+def test_short_tail_is_merged_into_previous_segment():
+    assert plan_segments(61, 30, min_tail=10, strategy='merge') == [(0, 30), (30, 31)]
+
+
+def test_short_tail_is_rebalanced_across_segments():
+    assert plan_segments(61, 30, min_tail=10, strategy='rebalance') == [(0.0, 30.5), (30.5, 30.5)]
+
+
+def test_min_tail_is_capped_at_half_a_slice():
+    # A 5s tail of 10s slices is kept even with a 10s minimum: it is not shorter than half a slice
+    assert plan_segments(25, 10, min_tail=10) == [(0, 10), (10, 10), (20, 5)]
+    assert plan_segments(24, 10, min_tail=10) == [(0, 10), (10, 14)]
+
+
+def test_source_shorter_than_one_slice_is_one_segment():
+    assert plan_segments(12.5, 30, min_tail=10) == [(0, 12.5)]
+
+
+def test_empty_source_has_no_segments():
+    assert plan_segments(0, 30) == []
+
+
+def test_segments_cover_the_source():
+    for strategy in ('merge', 'rebalance'):
+        segments = plan_segments(3601.7, 45, min_tail=20, strategy=strategy)
+        assert segments[0][0] == 0
+        for (start, duration), (next_start, _) in zip(segments, segments[1:]):
+            assert next_start == pytest.approx(start + duration, abs=0.01)
+        assert segments[-1][0] + segments[-1][1] == pytest.approx(3601.7, abs=0.01)
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        plan_segments(61, 30, strategy='drop')
+
+
+def test_plan_slices_numbers_and_names_segments():
+    slices = plan_slices(61, 30, 'abc', extension='m4a')
+    assert [(s['index'], s['start'], s['duration']) for s in slices] == [(1, 0, 30), (2, 30, 31)]
+    assert slices[1]['filename'] == 'short_segment_2_abc.m4a'
+    assert all(s['status'] == 'pending' for s in slices)
+
+
+def indexes(batches):
+    return [[s['index'] for s in batch] for batch in batches]
+
+
+def test_short_adjacent_slices_are_batched_up_to_batch_size():
+    slices = plan_slices(23, 5, 's')
+    assert indexes(plan_batches(slices, max_segment_seconds=15, batch_size=3)) == [[1, 2, 3], [4, 5]]
+
+
+def test_long_slices_are_not_batched():
+    slices = plan_slices(90, 30, 's')
+    assert indexes(plan_batches(slices, max_segment_seconds=15, batch_size=8)) == [[1], [2], [3]]
+
+
+def test_batching_disabled_with_zero_max():
+    slices = plan_slices(20, 5, 's')
+    assert indexes(plan_batches(slices, max_segment_seconds=0)) == [[1], [2], [3], [4]]
+
+
+def test_gaps_and_long_slices_split_batches():
+    slices = plan_slices(40, 5, 's')
+    del slices[3] # Slice 4 is already done
+    slices[5]['duration'] = 30 # Slice 7 is too long to batch
+    assert indexes(plan_batches(slices, max_segment_seconds=15, batch_size=8)) == [[1, 2, 3], [5, 6], [7], [8]]